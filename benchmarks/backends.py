@@ -0,0 +1,83 @@
+# Compares the time the render backends take to export the example documents. Backends which are not available are
+# skipped. Run with:
+#
+#     python3 -m benchmarks.backends
+#
+# Unlike benchmarks.pipeline, this runs the actual renderers, so the results depend on the installed versions.
+
+import sys
+import timeit
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from inkscapeflatten.exporter import backends, get_inkscape_version, get_rsvg_convert_version, open_exporter
+from inkscapeflatten.util import UserError
+
+_examples_dir = Path(__file__).parent.parent / 'examples'
+
+
+def _is_available(backend: str, inkscape_executable: str):
+    if backend in ['inkscape', 'inkscape-pipe']:
+        return get_inkscape_version(inkscape_executable) is not None
+    elif backend == 'rsvg':
+        return get_rsvg_convert_version('rsvg-convert') is not None
+    else:
+        try:
+            open_exporter(inkscape_executable, backend).close()
+        except UserError:
+            return False
+
+        return True
+
+
+# Returns the fastest time to export each of the documents with a backend. The exporter is started once before
+# measuring, like when exporting multiple outputs.
+def run_backend(backend: str, inkscape_executable: str, svg_paths: list, temp_dir: Path, repeat: int):
+    times = {}
+
+    with open_exporter(inkscape_executable, backend) as exporter:
+        for i in svg_paths:
+            pdf_path = temp_dir / (i.stem + '.pdf')
+
+            times[i.name] = min(
+                timeit.repeat(lambda: exporter.export_pdf(i, pdf_path), number=1, repeat=repeat))
+
+    return times
+
+
+def main():
+    parser = ArgumentParser()
+
+    parser.add_argument('--inkscape', default='inkscape', dest='inkscape_executable')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of which the fastest is used.')
+    parser.add_argument('backends', nargs='*', help='Backends to compare, all by default: {}'.format(', '.join(backends)))
+
+    args = parser.parse_args()
+
+    for i in args.backends:
+        if i not in backends:
+            parser.error('Unknown backend: {}'.format(i))
+
+    svg_paths = sorted(_examples_dir.glob('*.svg'))
+
+    with TemporaryDirectory() as temp_dir:
+        for backend in args.backends or backends:
+            if not _is_available(backend, args.inkscape_executable):
+                print('{:>10} not available, skipped'.format(backend), file=sys.stderr)
+                continue
+
+            try:
+                times = run_backend(backend, args.inkscape_executable, svg_paths, Path(temp_dir), args.repeat)
+            except UserError as e:
+                print('{:>10} failed: {}'.format(backend, e), file=sys.stderr)
+                continue
+
+            for name, time in times.items():
+                print('{:>10} {:>16} {:10.3f} ms'.format(backend, name, time * 1000))
+
+            print('{:>10} {:>16} {:10.3f} ms'.format(backend, 'total', sum(times.values()) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Generates synthetic Inkscape SVG documents for benchmarking. Can also be run to write a document to a file, e.g.:
+#
+#     python3 -m benchmarks.documents --layers 50 --depth 3 --clones 1000 large.svg
+
+import base64
+import random
+from argparse import ArgumentParser
+from pathlib import Path
+
+from lxml import etree
+
+_svg_ns = 'http://www.w3.org/2000/svg'
+_inkscape_ns = 'http://www.inkscape.org/namespaces/inkscape'
+_sodipodi_ns = 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd'
+_xlink_ns = 'http://www.w3.org/1999/xlink'
+
+_nsmap = {None: _svg_ns, 'inkscape': _inkscape_ns, 'sodipodi': _sodipodi_ns, 'xlink': _xlink_ns}
+
+
+def _svg(tag):
+    return '{{{}}}{}'.format(_svg_ns, tag)
+
+
+class DocumentParameters:
+    def __init__(
+            self, layer_count: int = 10, depth: int = 1, paths_per_layer: int = 10, segments_per_path: int = 20,
+            clone_count: int = 0, image_count: int = 0, image_size: int = 10000, defs_count: int = 10,
+            seed: int = 0):
+        # Number of top-level layers. Each of them contains a chain of depth - 1 nested sublayers.
+        self.layer_count = layer_count
+        self.depth = depth
+        self.paths_per_layer = paths_per_layer
+        self.segments_per_path = segments_per_path
+
+        # Number of <use> elements, distributed over all layers, which reference symbols in <defs>.
+        self.clone_count = clone_count
+
+        # Number of embedded images, distributed over all layers, and the size of their data in bytes.
+        self.image_count = image_count
+        self.image_size = image_size
+
+        # Number of gradients in <defs>, of which every other one is referenced.
+        self.defs_count = defs_count
+        self.seed = seed
+
+
+def generate_document(parameters: DocumentParameters):
+    rnd = random.Random(parameters.seed)
+
+    def coordinate():
+        return '{:.3f},{:.3f}'.format(rnd.uniform(0, 1000), rnd.uniform(0, 1000))
+
+    def path_data():
+        parts = ['M', coordinate()]
+
+        for _ in range(parameters.segments_per_path):
+            parts.extend(['C', coordinate(), coordinate(), coordinate()])
+
+        parts.append('Z')
+
+        return ' '.join(parts)
+
+    root = etree.Element(_svg('svg'), nsmap=_nsmap)
+    root.set('width', '1000mm')
+    root.set('height', '1000mm')
+    root.set('viewBox', '0 0 1000 1000')
+
+    etree.SubElement(root, '{{{}}}namedview'.format(_sodipodi_ns), id='namedview', pagecolor='#ffffff')
+
+    defs = etree.SubElement(root, _svg('defs'), id='defs')
+
+    for i in range(parameters.defs_count):
+        gradient = etree.SubElement(defs, _svg('linearGradient'), id='gradient-{}'.format(i))
+        etree.SubElement(gradient, _svg('stop'), offset='0', style='stop-color:#{:06x}'.format(rnd.randrange(1 << 24)))
+        etree.SubElement(gradient, _svg('stop'), offset='1', style='stop-color:#{:06x}'.format(rnd.randrange(1 << 24)))
+
+    symbol_count = min(parameters.clone_count, 10)
+
+    for i in range(symbol_count):
+        symbol = etree.SubElement(defs, _svg('g'), id='symbol-{}'.format(i))
+        etree.SubElement(symbol, _svg('path'), d=path_data())
+        etree.SubElement(symbol, _svg('circle'), cx='0', cy='0', r='{:.3f}'.format(rnd.uniform(1, 20)))
+
+    layer_nodes = []
+
+    for i in range(parameters.layer_count):
+        parent = root
+
+        for j in range(parameters.depth):
+            label = 'layer-{}'.format(i) if j == 0 else 'sublayer-{}'.format(j)
+            layer = etree.SubElement(parent, _svg('g'), id='layer-{}-{}'.format(i, j))
+            layer.set('{{{}}}groupmode'.format(_inkscape_ns), 'layer')
+            layer.set('{{{}}}label'.format(_inkscape_ns), label)
+            layer_nodes.append(layer)
+            parent = layer
+
+    path_id = 0
+
+    for layer in layer_nodes:
+        for _ in range(parameters.paths_per_layer):
+            if parameters.defs_count:
+                fill = 'url(#gradient-{})'.format(rnd.randrange(0, parameters.defs_count, 2))
+            else:
+                fill = '#000000'
+
+            etree.SubElement(
+                layer,
+                _svg('path'),
+                id='path-{}'.format(path_id),
+                d=path_data(),
+                style='fill:{};stroke:#000000;stroke-width:0.26'.format(fill))
+
+            path_id += 1
+
+    for i in range(parameters.clone_count):
+        use = etree.SubElement(layer_nodes[i % len(layer_nodes)], _svg('use'))
+        use.set('{{{}}}href'.format(_xlink_ns), '#symbol-{}'.format(i % symbol_count))
+        use.set('transform', 'translate({})'.format(coordinate()))
+
+    for i in range(parameters.image_count):
+        data = base64.b64encode(bytes(rnd.getrandbits(8) for _ in range(parameters.image_size))).decode()
+        image = etree.SubElement(
+            layer_nodes[i % len(layer_nodes)], _svg('image'), x='0', y='0', width='100', height='100')
+        image.set('{{{}}}href'.format(_xlink_ns), 'data:image/png;base64,' + data)
+
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def main():
+    defaults = DocumentParameters()
+    parser = ArgumentParser()
+
+    parser.add_argument('output_path', type=Path)
+    parser.add_argument('--layers', type=int, default=defaults.layer_count, dest='layer_count')
+    parser.add_argument('--depth', type=int, default=defaults.depth)
+    parser.add_argument('--paths', type=int, default=defaults.paths_per_layer, dest='paths_per_layer')
+    parser.add_argument('--segments', type=int, default=defaults.segments_per_path, dest='segments_per_path')
+    parser.add_argument('--clones', type=int, default=defaults.clone_count, dest='clone_count')
+    parser.add_argument('--images', type=int, default=defaults.image_count, dest='image_count')
+    parser.add_argument('--image-size', type=int, default=defaults.image_size)
+    parser.add_argument('--defs', type=int, default=defaults.defs_count, dest='defs_count')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+
+    args = vars(parser.parse_args())
+    output_path = args.pop('output_path')
+
+    output_path.write_bytes(generate_document(DocumentParameters(**args)))
+
+
+if __name__ == '__main__':
+    main()
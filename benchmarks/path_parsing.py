@@ -0,0 +1,59 @@
+# Compares the path parser in inkscapeflatten.paths against the vendored one. Run with:
+#
+#     python3 -m benchmarks.path_parsing
+
+import random
+import timeit
+
+from inkscapeflatten.paths import parse_path, parse_cubic_super_path
+from inkscapeflatten.vendored import cubicsuperpath, simplepath
+
+
+def generate_path_data(segment_count: int, seed: int = 0):
+    rnd = random.Random(seed)
+
+    def coordinates(count):
+        return ' '.join('{:.3f},{:.3f}'.format(rnd.uniform(-500, 500), rnd.uniform(-500, 500)) for _ in range(count))
+
+    parts = ['M', coordinates(1)]
+
+    for _ in range(segment_count):
+        command = rnd.choice('LlCcQqHhVvSs')
+
+        if command in 'Hh':
+            parts.append('{}{:.3f}'.format(command, rnd.uniform(-500, 500)))
+        elif command in 'Vv':
+            parts.append('{}{:.3f}'.format(command, rnd.uniform(-500, 500)))
+        else:
+            parts.append(command + coordinates(dict(L=1, C=3, Q=2, S=2)[command.upper()]))
+
+    parts.append('z')
+
+    return ' '.join(parts)
+
+
+def benchmark(name, fn, d, repeat):
+    return min(timeit.repeat(lambda: fn(d), number=1, repeat=repeat))
+
+
+def main():
+    comparisons = [
+        ('simplepath.parsePath', simplepath.parsePath, 'parse_path', parse_path),
+        ('cubicsuperpath.parsePath', cubicsuperpath.parsePath, 'parse_cubic_super_path', parse_cubic_super_path)]
+
+    for segment_count in [10, 1000, 50000]:
+        d = generate_path_data(segment_count)
+        repeat = max(3, 20000 // segment_count)
+
+        for vendored_name, vendored_fn, name, fn in comparisons:
+            assert fn(d) == vendored_fn(d)
+
+            vendored_time = benchmark(vendored_name, vendored_fn, d, repeat)
+            time = benchmark(name, fn, d, repeat)
+
+            print('{:>6} segments: {:>24} {:9.3f} ms, {:>22} {:9.3f} ms ({:.1f}x)'.format(
+                segment_count, vendored_name, vendored_time * 1000, name, time * 1000, vendored_time / time))
+
+
+if __name__ == '__main__':
+    main()
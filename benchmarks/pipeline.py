@@ -0,0 +1,144 @@
+# Times the stages of the export pipeline on synthetic documents. PDF files are "rendered" by a stub exporter so that
+# only the Python side is measured. Run with:
+#
+#     python3 -m benchmarks.pipeline --save-baseline baseline.json
+#
+# After making changes, compare against the baseline. Exits with status 1 if a benchmark got slower than the tolerance:
+#
+#     python3 -m benchmarks.pipeline --baseline baseline.json
+
+import json
+import sys
+import timeit
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from benchmarks.documents import DocumentParameters, generate_document
+from inkscapeflatten.exporter import Exporter
+from inkscapeflatten.inkscape import SVGDocument, _Overlay, _compute_layer_bounds, _gather_layers, \
+    _hide_deselected_layers
+from inkscapeflatten.patterns import select_layers
+
+scenarios = {
+    'small': DocumentParameters(),
+    'many-layers': DocumentParameters(layer_count=500, paths_per_layer=2),
+    'deep': DocumentParameters(layer_count=20, depth=20, paths_per_layer=2),
+    'long-paths': DocumentParameters(paths_per_layer=20, segments_per_path=2000),
+    'clones': DocumentParameters(layer_count=5, clone_count=5000),
+    'images': DocumentParameters(image_count=20, image_size=200000),
+    'large-defs': DocumentParameters(defs_count=20000)}
+
+# Selects every other top-level layer.
+_layer_pattern = 'layer-*[02468]'
+
+_stub_pdf = b'%PDF-1.4\n%%EOF\n'
+
+
+# Writes a constant PDF file instead of running Inkscape.
+class StubExporter(Exporter):
+    @property
+    def cache_key(self):
+        return 'stub'
+
+    @property
+    def can_pipe(self):
+        return True
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        svg_path.read_bytes()
+        pdf_path.write_bytes(_stub_pdf)
+
+    def export_pdf_data(self, svg_data: bytes):
+        return _stub_pdf
+
+
+def _measure(fn, repeat: int):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def run_scenario(parameters: DocumentParameters, temp_dir: Path, repeat: int):
+    svg_path = temp_dir / 'document.svg'
+    pdf_path = temp_dir / 'document.pdf'
+    svg_path.write_bytes(generate_document(parameters))
+
+    document = SVGDocument.from_file(svg_path)
+    layers = select_layers(document.layers, [_layer_pattern])[0]
+
+    def hide_deselected_layers():
+        overlay = _Overlay()
+        _hide_deselected_layers(overlay, document.tree, document.nodes_by_id, layers)
+        overlay.revert()
+
+    def export():
+        exported_document = SVGDocument.from_file(svg_path)
+        exported_layers = select_layers(exported_document.layers, [_layer_pattern])[0]
+        clip_layer = exported_layers[0]
+        exported_document.save_to_pdf(pdf_path, exported_layers, clip_layer, exporter=StubExporter())
+
+    return {
+        'from_file': _measure(lambda: SVGDocument.from_file(svg_path), repeat),
+        'gather_layers': _measure(lambda: _gather_layers(document.tree), repeat),
+        'select_layers': _measure(lambda: select_layers(document.layers, [_layer_pattern])[0], repeat),
+        'hide_deselected_layers': _measure(hide_deselected_layers, repeat),
+        'compute_bounds': _measure(
+            lambda: _compute_layer_bounds(document.tree, document.nodes_by_id, document.layers), repeat),
+        'export': _measure(export, repeat)}
+
+
+def _compare(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+
+    for scenario, times in results.items():
+        for stage, time in times.items():
+            baseline_time = baseline.get(scenario, {}).get(stage)
+
+            if baseline_time is None:
+                comparison = ''
+            else:
+                ratio = time / baseline_time
+                comparison = '{:6.2f}x'.format(ratio)
+
+                if ratio > 1 + tolerance:
+                    comparison += ' SLOWER'
+                    regressions.append((scenario, stage))
+
+            print('{:>12} {:>24} {:10.3f} ms {}'.format(scenario, stage, time * 1000, comparison))
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+
+    parser.add_argument('--baseline', type=Path, help='Compare against the results stored in this file.')
+    parser.add_argument('--save-baseline', type=Path, help='Store the results in this file.')
+    parser.add_argument('--tolerance', type=float, default=.2, help='Allowed slowdown relative to the baseline.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs of which the fastest is used.')
+    parser.add_argument('scenarios', nargs='*', help='Scenarios to run, all by default: {}'.format(', '.join(scenarios)))
+
+    args = parser.parse_args()
+
+    for i in args.scenarios:
+        if i not in scenarios:
+            parser.error('Unknown scenario: {}'.format(i))
+
+    baseline = {} if args.baseline is None else json.loads(args.baseline.read_text())
+    results = {}
+
+    with TemporaryDirectory() as temp_dir:
+        for name in args.scenarios or scenarios:
+            results[name] = run_scenario(scenarios[name], Path(temp_dir), args.repeat)
+
+    regressions = _compare(results, baseline, args.tolerance)
+
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(results, indent=4) + '\n')
+
+    if regressions:
+        print('{} benchmarks are slower than the baseline.'.format(len(regressions)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+#! /usr/bin/env bash
+
+set -eu
+
+cd "$(dirname "$BASH_SOURCE")"
+
+# Same outputs as layers.sh, but the SVG file is only parsed once.
+inkscape-flatten -m layers.json layers.svg
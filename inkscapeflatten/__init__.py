@@ -1,11 +1,26 @@
-import fnmatch
+import cProfile
+import io
+import json
 import re
+import shlex
 import sys
-from argparse import ArgumentParser, ArgumentTypeError
+import traceback
+from argparse import Action, ArgumentParser, ArgumentTypeError
+from contextlib import redirect_stderr, redirect_stdout
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from inkscapeflatten.inkscape import SVGDocument, Layer, Transformation
-from inkscapeflatten.util import UserError
+from inkscapeflatten.cache import PDFCache, default_cache_dir
+from inkscapeflatten.compose import LayerComposer
+from inkscapeflatten.exporter import ExporterPool, backends
+from inkscapeflatten.images import default_image_dir
+from inkscapeflatten.inkscape import SVGDocument, Layer, Transformation, iter_layer_paths, write_pdf_pages
+from inkscapeflatten.patterns import get_layer, select_layers
+from inkscapeflatten.server import DocumentCache, serve
+from inkscapeflatten.timings import Timings, measure, recording_timings
+from inkscapeflatten.util import UserError, is_stdio_path
+from inkscapeflatten.watch import watch_files
+from inkscapeflatten_client import default_socket_path, get_socket_path
 
 
 class LayerSelection:
@@ -41,41 +56,138 @@ class LayerSelection:
         return cls(selection_pattern, (offset_x, offset_y))
 
 
-def _select_layers(document: SVGDocument, pattern: str):
-    layers = [document.layers]
+class PageSpec:
+    def __init__(self, layers: list, clip: str):
+        self.layers = layers
+        self.clip = clip
 
-    for pattern_part in pattern.split('/'):
-        layers = [
-            child
-            for i in layers
-            for name, child in i.items()
-            if fnmatch.fnmatchcase(name, pattern_part)]
+    # Parses a list of layer selections separated by whitespace. Layer selections containing whitespace can be quoted
+    # like in a shell.
+    @classmethod
+    def from_string(cls, string):
+        try:
+            parts = shlex.split(string)
+        except ValueError as e:
+            raise ArgumentTypeError('Invalid page: {}: {}'.format(string, e))
 
-    if not layers:
-        raise UserError('Pattern did not match any layers: {}'.format(pattern))
+        return cls([LayerSelection.from_string(i) for i in parts], None)
 
-    return layers
 
+class OutputSpec:
+    def __init__(self, output_pdf_path: Path, pages: list):
+        self.output_pdf_path = output_pdf_path
+        self.pages = pages
 
-def _get_layer(document: SVGDocument, path: str):
-    layer = document.layers
 
-    for i in path.split('/'):
-        layer = layer.get(i)
+def _load_manifest(path: Path):
+    try:
+        if path.suffix == '.toml':
+            import tomllib
 
-        if layer is None:
-            raise UserError('Layer not found: {}'.format(path))
+            with path.open('rb') as file:
+                data = tomllib.load(file)
+        else:
+            with path.open('r', encoding='utf-8') as file:
+                data = json.load(file)
+    except ImportError:
+        raise UserError('Reading TOML manifests requires Python 3.11 or later: {}'.format(path))
+    except (OSError, ValueError) as e:
+        raise UserError('Could not read manifest {}: {}'.format(path, e))
 
-    return layer
+    if not isinstance(data, dict):
+        raise UserError('Manifest must contain a table at the top level: {}'.format(path))
 
+    def get_page_spec(entry):
+        if not isinstance(entry, dict):
+            raise UserError('Manifest page must be a table: {}'.format(entry))
+
+        layer_strings = entry.get('layers', [])
+        clip = entry.get('clip')
+
+        if not isinstance(layer_strings, list) or not all(isinstance(i, str) for i in layer_strings):
+            raise UserError('"layers" of a manifest entry must be a list of strings: {}'.format(entry))
+
+        if clip is not None and not isinstance(clip, str):
+            raise UserError('"clip" of a manifest entry must be a string: {}'.format(entry))
+
+        try:
+            layers = [LayerSelection.from_string(i) for i in layer_strings]
+        except ArgumentTypeError as e:
+            raise UserError(str(e))
+
+        return PageSpec(layers, clip)
+
+    def iter_output_specs():
+        outputs = data.get('outputs', [])
+
+        if not isinstance(outputs, list):
+            raise UserError('"outputs" of the manifest must be a list of tables: {}'.format(path))
+
+        for entry in outputs:
+            if not isinstance(entry, dict):
+                raise UserError('Manifest entry must be a table: {}'.format(entry))
+
+            if 'output' not in entry:
+                raise UserError('Manifest entry is missing "output": {}'.format(entry))
+
+            if not isinstance(entry['output'], str):
+                raise UserError('"output" of a manifest entry must be a string: {}'.format(entry))
+
+            # Output paths are relative to the manifest, like in a Makefile.
+            output_pdf_path = path.parent / entry['output']
+
+            if 'pages' in entry:
+                if 'layers' in entry or 'clip' in entry:
+                    raise UserError('Manifest entry with "pages" cannot have "layers" or "clip": {}'.format(entry))
+
+                if not isinstance(entry['pages'], list):
+                    raise UserError('"pages" of a manifest entry must be a list of tables: {}'.format(entry))
+
+                if not entry['pages']:
+                    raise UserError('Manifest entry has no pages: {}'.format(entry))
+
+                pages = [get_page_spec(i) for i in entry['pages']]
+            else:
+                pages = [get_page_spec(entry)]
+
+            yield OutputSpec(output_pdf_path, pages)
+
+    output_specs = list(iter_output_specs())
+
+    if not output_specs:
+        raise UserError('Manifest does not list any outputs: {}'.format(path))
+
+    return output_specs
+
+
+# Appends each page to a list.
+class _PageAction(Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, (getattr(namespace, self.dest) or []) + [values])
 
-def parse_args():
-    parser = ArgumentParser()
+
+# Sets the clip layer of the last page, if a page has been specified before. Otherwise, sets the clip layer used for
+# the output or all pages.
+class _ClipAction(Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        if namespace.pages:
+            page = namespace.pages[-1]
+
+            if page.clip is not None:
+                parser.error('Only one --clip can be specified for each --page.')
+
+            page.clip = values
+        else:
+            setattr(namespace, self.dest, values)
+
+
+def _create_parser(parser_class=ArgumentParser):
+    parser = parser_class()
 
     parser.add_argument(
         'input_svg_path',
         type=Path,
-        help='Path from which to load an Inkscape SVG file.')
+        help='Path from which to load an Inkscape SVG file. Use - to read from stdin.')
 
     parser.add_argument(
         '-o',
@@ -83,20 +195,30 @@ def parse_args():
         type=Path,
         metavar='output_pdf_path',
         dest='output_pdf_path',
-        help='Path to which a PDF contining the selected layers should be written to.')
+        help='Path to which a PDF contining the selected layers should be written to. Use - to write to stdout.')
 
     parser.add_argument(
         'layers',
         type=LayerSelection.from_string,
         nargs='*',
         metavar='layer_pattern',
-        help='Shell-like patterns used to select which layers from the SVG file to export. Each pattern is matched agains the full path of each layer. When no patterns are given, all layers marked as "visible" are exported. Patterns can be suffixed with @<offset_x>,<offset_y> to offset the selcted layer by the specified vector.')
+        help='Shell-like patterns used to select which layers from the SVG file to export. Each pattern is matched agains the full path of each layer. A path component ** matches any number of nested layers. When no patterns are given, all layers marked as "visible" are exported. Patterns can be suffixed with @<offset_x>,<offset_y> to offset the selcted layer by the specified vector.')
 
     parser.add_argument(
         '-c',
         '--clip',
+        action=_ClipAction,
         metavar='clip_layer',
-        help='Full path of a layer used to clip the generated PDF file. The document is clipped to the bounding box of the this layer\'s content before exporting.')
+        help='Full path of a layer used to clip the generated PDF file. The document is clipped to the bounding box of the this layer\'s content before exporting. When specified after a --page, only that page is clipped.')
+
+    parser.add_argument(
+        '-p',
+        '--page',
+        type=PageSpec.from_string,
+        action=_PageAction,
+        metavar='layer_patterns',
+        dest='pages',
+        help='Add a page to the output showing the layers selected by the layer patterns, which are separated by whitespace and have the same syntax as layer_pattern. Patterns containing whitespace can be quoted like in a shell. Can be specified multiple times to write a PDF file with multiple pages. The SVG file is parsed only once and all pages are exported by the same Inkscape process.')
 
     parser.add_argument(
         '-L',
@@ -104,7 +226,107 @@ def parse_args():
         action='store_true',
         help='Instead of exporting the SVG document to a PDF, print a list of the full paths of all layers.')
 
-    args = parser.parse_args()
+    parser.add_argument(
+        '--bbox',
+        action='store_true',
+        help='With --list, also print the bounding box of each layer\'s content as xmin, ymin, xmax and ymax in user units.')
+
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        type=Path,
+        metavar='manifest_path',
+        dest='manifest_path',
+        help='Path to a JSON or TOML file listing multiple outputs to generate from the SVG file, which is parsed only once. The file contains a list "outputs" of entries with the keys "output", "layers" and "clip", which have the same meaning as the command line arguments. Instead of "layers" and "clip", an entry can have a list "pages" of tables with the keys "layers" and "clip" to write a PDF file with multiple pages. Output paths are relative to the manifest file.')
+
+    parser.add_argument(
+        '--inkscape',
+        default='inkscape',
+        metavar='inkscape_path',
+        dest='inkscape_executable',
+        help='Inkscape executable used to export PDF files. Inkscape 1.x is kept running in --shell mode while all outputs are exported. Defaults to "inkscape".')
+
+    parser.add_argument(
+        '--backend',
+        choices=list(backends),
+        default='inkscape',
+        help='Program used to render the SVG files to PDF files. "rsvg" uses rsvg-convert and "cairosvg" uses the cairosvg Python package. Both are much faster than Inkscape but do not support some Inkscape specific features, e.g. flowed text. Defaults to "inkscape".')
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='jobs',
+        help='Number of outputs exported concurrently, each by its own Inkscape process. Defaults to 1.')
+
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='Leave the content of layers which are not exported out of the SVG file passed to Inkscape instead of only hiding it. Content referenced by exported layers, e.g. through <use> elements, gradients, clip paths, masks or filters, is kept.')
+
+    parser.add_argument(
+        '--gc-defs',
+        action='store_true',
+        help='Remove gradients, patterns, markers, filters and other content of <defs> elements which is not referenced from the exported layers from the SVG file passed to Inkscape. Prints how much was removed.')
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_false',
+        dest='use_cache',
+        help='Always run Inkscape instead of reusing a previously exported PDF file for identical content from {}.'.format(
+            default_cache_dir()))
+
+    parser.add_argument(
+        '--externalize-images',
+        action='store_true',
+        help='Move images embedded in the SVG file to files in {}, where each distinct image is stored once, and reference them from the SVG data passed to the renderer instead of passing their data for each output. Not supported by --backend rsvg.'.format(
+            default_image_dir()))
+
+    parser.add_argument(
+        '--compose',
+        action='store_true',
+        help='Render each selected layer only once, together with its sublayers, and assemble the outputs from the rendered layers instead of rendering each combination of layers. Offsets are applied when assembling the outputs. Group effects like opacity of a layer containing multiple selected layers are applied to each of them separately.')
+
+    parser.add_argument(
+        '-w',
+        '--watch',
+        action='store_true',
+        help='Keep running and export the outputs again whenever the SVG file or the manifest changes. Only outputs whose selected layers, clip layer or referenced content changed are exported again.')
+
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print the wall and CPU time spent in each stage, e.g. parsing, computing bounds, serializing and running Inkscape, after exporting.')
+
+    parser.add_argument(
+        '--timings-json',
+        type=Path,
+        metavar='timings_json_path',
+        dest='timings_json_path',
+        help='Write the time spent in each stage as JSON to the specified file.')
+
+    parser.add_argument(
+        '--timings-trace',
+        type=Path,
+        metavar='timings_trace_path',
+        dest='timings_trace_path',
+        help='Write the time spent in each stage by each thread in the Trace Event Format to the specified file, which can be loaded into chrome://tracing or Perfetto.')
+
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        metavar='profile_path',
+        dest='profile_path',
+        help='Profile the main thread using cProfile and write the statistics to the specified file, which can be read using the pstats module.')
+
+    return parser
+
+
+def _check_args(parser: ArgumentParser, args):
+    # --jobs is not set for requests to the server.
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1.')
 
     if args.list:
         if args.output_pdf_path is not None:
@@ -115,48 +337,518 @@ def parse_args():
 
         if args.clip is not None:
             parser.error('Only one of --clip and --list can be specified.')
+
+        if args.pages:
+            parser.error('Only one of --page and --list can be specified.')
+
+        if args.manifest_path is not None:
+            parser.error('Only one of --manifest and --list can be specified.')
+
+        if args.watch:
+            parser.error('Only one of --watch and --list can be specified.')
+    elif args.manifest_path is not None:
+        if args.output_pdf_path is not None:
+            parser.error('Only one of --output and --manifest can be specified.')
+
+        if args.layers:
+            parser.error('Layer patterns cannot be used together with --manifest.')
+
+        if args.clip is not None:
+            parser.error('Only one of --clip and --manifest can be specified.')
+
+        if args.pages:
+            parser.error('Pages cannot be specified together with --manifest.')
     else:
         if args.output_pdf_path is None:
-            parser.error('One of --output or --list must be specified.')
+            parser.error('One of --output, --manifest or --list must be specified.')
+
+        if args.pages and args.layers:
+            parser.error('Layer patterns cannot be used together with --page.')
+
+    if args.bbox and not args.list:
+        parser.error('--bbox can only be used together with --list.')
+
+    if args.watch and (is_stdio_path(args.input_svg_path) or is_stdio_path(args.output_pdf_path)):
+        parser.error('--watch cannot be used when reading from stdin or writing to stdout.')
+
+    _check_externalize_images(parser, args)
+
+
+# rsvg-convert refuses to load files which are not next to the SVG file.
+def _check_externalize_images(parser: ArgumentParser, args):
+    if args.externalize_images and args.backend == 'rsvg':
+        parser.error('--externalize-images cannot be used together with --backend rsvg.')
+
+
+def parse_args():
+    parser = _create_parser()
+    args = parser.parse_args()
+    _check_args(parser, args)
 
     return args
 
 
-def main(input_svg_path: Path, output_pdf_path: Path, layers: list, clip: str, list: bool):
-    document = SVGDocument.from_file(input_svg_path)
+def parse_serve_args(argv: list):
+    parser = ArgumentParser(
+        prog='inkscape-flatten serve',
+        description='Keep documents and Inkscape processes loaded and handle requests from inkscape-flatten-client, which takes the same arguments as inkscape-flatten, on a Unix socket.')
 
-    if list:
-        # Do not list the root layer (which has an empty name).
-        for i in document.layers.flatten[1:]:
-            print('/'.join(i.path))
+    parser.add_argument(
+        '--socket',
+        type=Path,
+        default=get_socket_path(),
+        metavar='socket_path',
+        dest='socket_path',
+        help='Path of the Unix socket on which to listen. Defaults to $INKSCAPE_FLATTEN_SOCKET or {}.'.format(
+            default_socket_path()))
+
+    parser.add_argument(
+        '--max-documents',
+        type=int,
+        default=DocumentCache.default_max_count,
+        metavar='max_documents',
+        help='Number of parsed documents which are kept in memory. Defaults to {}.'.format(
+            DocumentCache.default_max_count))
+
+    parser.add_argument(
+        '--inkscape',
+        default='inkscape',
+        metavar='inkscape_path',
+        dest='inkscape_executable',
+        help='Inkscape executable used to export PDF files. Defaults to "inkscape".')
+
+    parser.add_argument(
+        '--backend',
+        choices=list(backends),
+        default='inkscape',
+        help='Program used to render the SVG files to PDF files. Defaults to "inkscape".')
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='jobs',
+        help='Number of outputs of a request exported concurrently. Defaults to 1.')
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_false',
+        dest='use_cache',
+        help='Always run Inkscape instead of reusing a previously exported PDF file for identical content.')
+
+    parser.add_argument(
+        '--externalize-images',
+        action='store_true',
+        help='Move images embedded in loaded documents to files in {}, like inkscape-flatten --externalize-images.'.format(
+            default_image_dir()))
+
+    args = parser.parse_args(argv)
+
+    _check_externalize_images(parser, args)
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1.')
+
+    if args.max_documents < 1:
+        parser.error('--max-documents must be at least 1.')
+
+    return args
+
+
+# Returns the document with the offsets of the page's layer selections applied, the selected layers and the clip layer.
+def _resolve_page_spec(document: SVGDocument, page_spec: PageSpec):
+    transformation_by_layer = {}
+
+    if page_spec.layers:
+        selected_layers = set()
+
+        matched_layers = select_layers(document.layers, [i.pattern for i in page_spec.layers])
+
+        for i, layers in zip(page_spec.layers, matched_layers):
+            for j in layers:
+                selected_layers.add(j)
+
+                if i.offset != (0, 0):
+                    # FIXME: Offset for same layer may be specified through multiple selections.
+                    transformation_by_layer[j] = Transformation.from_offset(i.offset)
+    else:
+        selected_layers = None
+
+    document = document.with_transformed_layers(transformation_by_layer)
+
+    if page_spec.clip is None:
+        clip_layer = None
+    else:
+        clip_layer = get_layer(document.layers, page_spec.clip)
+
+    return document, selected_layers, clip_layer
+
+
+def _get_output_specs(output_pdf_path: Path, layers: list, clip: str, pages: list, manifest_path: Path):
+    if pages:
+        # The clip layer specified before the first page applies to all pages without their own.
+        return [OutputSpec(output_pdf_path, [PageSpec(i.layers, clip if i.clip is None else i.clip) for i in pages])]
+    elif manifest_path is None:
+        return [OutputSpec(output_pdf_path, [PageSpec(layers, clip)])]
+    else:
+        return _load_manifest(manifest_path)
+
+
+# Returns the digests of the pages returned by _resolve_page_spec(), if digests are tracked.
+def _get_output_digest(pages: list, digests_by_name: dict):
+    if digests_by_name is None:
+        return None
+
+    return [page_document.get_output_digest(layers, clip_layer) for page_document, layers, clip_layer in pages]
+
+
+# Exports the outputs and waits for them to be written. When digests_by_name is passed, outputs whose digest did not
+# change since they were last exported are skipped and the digests of exported outputs are updated. Returns the number
+# of outputs which were exported.
+def _export_outputs(
+        document: SVGDocument, output_specs: list, pool: ExporterPool, cache: PDFCache, prune: bool, gc_defs: bool,
+        digests_by_name: dict = None):
+    def export(name, svg_data_list, path, digest, exporter):
+        write_pdf_pages(svg_data_list, path, cache, exporter)
+
+        if digests_by_name is not None:
+            digests_by_name[name] = digest
+
+    exported_count = 0
+
+    for i in output_specs:
+        name = str(i.output_pdf_path)
+
+        try:
+            pages = [_resolve_page_spec(document, j) for j in i.pages]
+            digest = _get_output_digest(pages, digests_by_name)
+
+            if digests_by_name is not None and digests_by_name.get(name) == digest and i.output_pdf_path.exists():
+                continue
+
+            svg_data_list = [
+                page_document.filtered_svg_data(layers, clip_layer, prune, gc_defs)
+                for page_document, layers, clip_layer in pages]
+        except UserError as e:
+            pool.add_error(name, e)
+        else:
+            pool.submit(name, export, name, svg_data_list, i.output_pdf_path, digest)
+            exported_count += 1
+
+    pool.wait()
+
+    return exported_count
+
+
+# Like _export_outputs(), but renders each layer only once and assembles the outputs from the rendered layers.
+def _compose_outputs(
+        document: SVGDocument, output_specs: list, pool: ExporterPool, cache: PDFCache, prune: bool, gc_defs: bool,
+        digests_by_name: dict = None):
+    errors = []
+    outputs = []
+
+    with TemporaryDirectory() as temp_dir:
+        composer = LayerComposer(document, Path(temp_dir), prune, gc_defs)
+
+        for i in output_specs:
+            name = str(i.output_pdf_path)
+
+            try:
+                pages = [_resolve_page_spec(document, j) for j in i.pages]
+                digest = _get_output_digest(pages, digests_by_name)
+
+                if digests_by_name is not None and digests_by_name.get(name) == digest \
+                        and i.output_pdf_path.exists():
+                    continue
+
+                composed_pages = [composer.add_page(*j) for j in pages]
+                outputs.append((name, i.output_pdf_path, composed_pages, digest))
+            except UserError as e:
+                errors.append((name, e))
+
+        try:
+            composer.render(pool, cache)
+            pool.wait()
+        except UserError as e:
+            render_error = e
+        else:
+            render_error = None
+
+        for name, path, composed_pages, digest in outputs:
+            # Outputs using a layer which failed to render are only reported through the error of the layer.
+            if not composer.is_rendered(composed_pages):
+                continue
+
+            try:
+                composer.write_output(path, composed_pages)
+            except UserError as e:
+                errors.append((name, e))
+            else:
+                if digests_by_name is not None:
+                    digests_by_name[name] = digest
+
+    if render_error is not None:
+        raise render_error
+
+    if len(output_specs) == 1 and errors:
+        raise errors[0][1]
+    elif errors:
+        raise UserError(
+            '{} of the outputs failed:\n'.format(len(errors))
+            + '\n'.join('{}: {}'.format(name, error) for name, error in errors))
+
+    return len(outputs)
+
+
+def _get_export_outputs_fn(compose: bool):
+    if compose:
+        return _compose_outputs
     else:
-        transformation_by_layer = {}
+        return _export_outputs
+
+
+# Keeps exporting the outputs whenever the SVG file or the manifest changes, until interrupted. Only outputs which are
+# affected by a change are exported again.
+def _watch(
+        input_svg_path: Path, output_pdf_path: Path, layers: list, clip: str, pages: list, manifest_path: Path,
+        pool: ExporterPool, cache: PDFCache, prune: bool, gc_defs: bool, compose: bool, image_dir: Path):
+    paths = [input_svg_path]
+
+    if manifest_path is not None:
+        paths.append(manifest_path)
+
+    digests_by_name = {}
 
-        if layers:
-            selected_layers = set()
+    try:
+        for _ in watch_files(paths):
+            try:
+                output_specs = _get_output_specs(output_pdf_path, layers, clip, pages, manifest_path)
+                document = _load_document(input_svg_path, image_dir)
+                exported_count = _get_export_outputs_fn(compose)(
+                    document, output_specs, pool, cache, prune, gc_defs, digests_by_name)
+            except UserError as e:
+                print('Error: {}'.format(e), file=sys.stderr)
+            else:
+                print(
+                    'Exported {} of {} outputs. Watching for changes ...'.format(exported_count, len(output_specs)),
+                    file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def _write_timings(timings: Timings, print_summary: bool, json_path: Path, trace_path: Path):
+    if print_summary:
+        print(timings.format_summary(), file=sys.stderr)
+
+    try:
+        if json_path is not None:
+            json_path.write_text(json.dumps(timings.to_json(), indent=4) + '\n', encoding='utf-8')
+
+        if trace_path is not None:
+            trace_path.write_text(json.dumps(timings.to_chrome_trace()), encoding='utf-8')
+    except OSError as e:
+        raise UserError('Could not write timings: {}'.format(e))
+
+
+# Loads the document and moves its embedded images to image_dir, unless it is None.
+def _load_document(path: Path, image_dir: Path):
+    document = SVGDocument.from_file(path)
+
+    if image_dir is not None:
+        document.externalize_images(image_dir)
 
-            for i in layers:
-                for j in _select_layers(document, i.pattern):
-                    selected_layers.add(j)
+    return document
 
-                    if i.offset != (0, 0):
-                        # FIXME: Offset for same layer may be specified through multiple selections.
-                        transformation_by_layer[j] = Transformation.from_offset(i.offset)
+
+def _print_layers(document: SVGDocument, bbox: bool):
+    # Do not list the root layer (which has an empty name).
+    for i in document.layers.flatten[1:]:
+        if not bbox:
+            print('/'.join(i.path))
+            continue
+
+        bounds = document.get_layer_bounds(i)
+
+        if bounds is None:
+            bounds_str = '-'
+        else:
+            xmin, xmax, ymin, ymax = bounds
+            bounds_str = '{} {} {} {}'.format(xmin, ymin, xmax, ymax)
+
+        print('{}\t{}'.format('/'.join(i.path), bounds_str))
+
+
+def _run(
+        input_svg_path: Path, output_pdf_path: Path, layers: list, clip: str, pages: list, list: bool, bbox: bool,
+        manifest_path: Path, inkscape_executable: str, backend: str, jobs: int, prune: bool, gc_defs: bool,
+        use_cache: bool, externalize_images: bool, compose: bool, watch: bool):
+    if list and bbox:
+        _print_layers(SVGDocument.from_file(input_svg_path), bbox)
+    elif list:
+        # Only the layer names are needed, so the document is never loaded completely.
+        with measure('parse'):
+            for i in iter_layer_paths(input_svg_path):
+                print('/'.join(i))
+    else:
+        if use_cache:
+            cache = PDFCache(default_cache_dir())
         else:
-            selected_layers = None
+            cache = None
 
-        document = document.with_transformed_layers(transformation_by_layer)
+        if externalize_images:
+            image_dir = default_image_dir()
+        else:
+            image_dir = None
+
+        with ExporterPool(inkscape_executable, jobs, backend) as pool:
+            if watch:
+                _watch(
+                    input_svg_path, output_pdf_path, layers, clip, pages, manifest_path, pool, cache, prune, gc_defs,
+                    compose, image_dir)
+            else:
+                document = _load_document(input_svg_path, image_dir)
+                output_specs = _get_output_specs(output_pdf_path, layers, clip, pages, manifest_path)
+
+                _get_export_outputs_fn(compose)(document, output_specs, pool, cache, prune, gc_defs)
+
+
+def main(
+        input_svg_path: Path, output_pdf_path: Path, layers: list, clip: str, pages: list, list: bool, bbox: bool,
+        manifest_path: Path, inkscape_executable: str, backend: str, jobs: int, prune: bool, gc_defs: bool,
+        use_cache: bool, externalize_images: bool, compose: bool, watch: bool, timings: bool, timings_json_path: Path,
+        timings_trace_path: Path, profile_path: Path):
+    def run():
+        _run(
+            input_svg_path, output_pdf_path, layers, clip, pages, list, bbox, manifest_path, inkscape_executable,
+            backend, jobs, prune, gc_defs, use_cache, externalize_images, compose, watch)
+
+    if profile_path is None:
+        profiler = None
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-        if clip is None:
-            clip_layer = None
+    try:
+        if timings or timings_json_path is not None or timings_trace_path is not None:
+            # Also report the timings of a failed run, they may tell where it failed.
+            try:
+                with recording_timings() as recorded_timings:
+                    run()
+            finally:
+                _write_timings(recorded_timings, timings, timings_json_path, timings_trace_path)
         else:
-            clip_layer = _get_layer(document, clip)
+            run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(profile_path))
+
+
+class _RequestExit(Exception):
+    def __init__(self, status: int):
+        self.status = status
+
+
+# Reports errors in the arguments of a request to the client instead of exiting.
+class _RequestArgumentParser(ArgumentParser):
+    def exit(self, status=0, message=None):
+        if message:
+            sys.stderr.write(message)
+
+        raise _RequestExit(status)
+
+
+def _run_request(
+        argv: list, cwd: Path, document_cache: DocumentCache, pool: ExporterPool, cache: PDFCache):
+    parser = _create_parser(_RequestArgumentParser)
+    parser.prog = 'inkscape-flatten-client'
+
+    # The exporters and the cache are set up when the server is started. Without defaults, these options are only set
+    # if they have been passed.
+    server_options = ['backend', 'inkscape_executable', 'jobs', 'use_cache']
+    parser.set_defaults(**dict.fromkeys(server_options))
+    args = parser.parse_args(argv)
+
+    if any(getattr(args, i) is not None for i in server_options):
+        parser.error(
+            '--backend, --inkscape, --jobs and --no-cache are not supported by the server, pass them to inkscape-flatten '
+            'serve instead.')
+
+    _check_args(parser, args)
 
-        document.save_to_pdf(output_pdf_path, selected_layers, clip_layer)
+    if is_stdio_path(args.input_svg_path) or is_stdio_path(args.output_pdf_path):
+        parser.error('Reading from stdin and writing to stdout is not supported by the server.')
+
+    if args.watch or args.timings or args.timings_json_path or args.timings_trace_path or args.profile_path:
+        parser.error('--watch, --profile and the --timings options are not supported by the server.')
+
+    if args.externalize_images:
+        parser.error('--externalize-images is not supported by the server, pass it to inkscape-flatten serve instead.')
+
+    # Paths are relative to the working directory of the client.
+    document = document_cache.get(cwd / args.input_svg_path)
+
+    if args.list:
+        _print_layers(document, args.bbox)
+    else:
+        output_pdf_path = None if args.output_pdf_path is None else cwd / args.output_pdf_path
+        manifest_path = None if args.manifest_path is None else cwd / args.manifest_path
+        output_specs = _get_output_specs(output_pdf_path, args.layers, args.clip, args.pages, manifest_path)
+
+        _get_export_outputs_fn(args.compose)(document, output_specs, pool, cache, args.prune, args.gc_defs)
+
+
+# Runs a request like inkscape-flatten would. Returns the exit status and the output written to stdout and stderr.
+def _handle_request(request: dict, document_cache: DocumentCache, pool: ExporterPool, cache: PDFCache):
+    # The streams have a buffer, as exporters write the output of Inkscape to it.
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='replace', write_through=True)
+    stderr = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='replace', write_through=True)
+    status = 0
+
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            _run_request(request['argv'], Path(request['cwd']), document_cache, pool, cache)
+        except UserError as e:
+            print('Error: {}'.format(e), file=sys.stderr)
+        except _RequestExit as e:
+            status = e.status
+        except Exception:
+            # Report the error to the client and keep serving other requests.
+            traceback.print_exc()
+            status = 1
+
+    return dict(
+        status=status,
+        stdout=stdout.buffer.getvalue().decode('utf-8', 'replace'),
+        stderr=stderr.buffer.getvalue().decode('utf-8', 'replace'))
+
+
+def serve_main(
+        socket_path: Path, max_documents: int, inkscape_executable: str, backend: str, jobs: int, use_cache: bool,
+        externalize_images: bool):
+    if use_cache:
+        cache = PDFCache(default_cache_dir())
+    else:
+        cache = None
+
+    if externalize_images:
+        image_dir = default_image_dir()
+    else:
+        image_dir = None
+
+    document_cache = DocumentCache(max_documents, image_dir)
+
+    with ExporterPool(inkscape_executable, jobs, backend) as pool:
+        serve(socket_path, lambda request: _handle_request(request, document_cache, pool, cache))
 
 
 def script_main():
     try:
-        main(**vars(parse_args()))
+        # A document called "serve" can still be exported as "./serve".
+        if sys.argv[1:2] == ['serve']:
+            serve_main(**vars(parse_serve_args(sys.argv[2:])))
+        else:
+            main(**vars(parse_args()))
     except UserError as e:
         print('Error: {}'.format(e), file=sys.stderr)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+from inkscapeflatten.cache import PDFCache
+from inkscapeflatten.exporter import Exporter, OneShotExporter
+from inkscapeflatten.inkscape import SVGDocument, Transformation, write_pdf_data
+from inkscapeflatten.patterns import get_layer, select_layers
+from inkscapeflatten.util import UserError
+
+
+# An output to export from a document. layers is a list of patterns selecting the layers, all layers marked as visible
+# are exported when it is None. offsets maps some of the patterns to an (x, y) offset applied to the layers they select.
+class ExportJob:
+    def __init__(self, path: Path, layers: list = None, clip: str = None, offsets: dict = None):
+        self.path = Path(path)
+        self.layers = layers
+        self.clip = clip
+        self.offsets = offsets or {}
+
+
+class ExportResult:
+    def __init__(self, job: ExportJob, error: UserError, cached: bool, timings: dict):
+        self.job = job
+
+        # The error which stopped the job, if it failed.
+        self.error = error
+
+        # Whether the PDF data was taken from the cache instead of being exported.
+        self.cached = cached
+
+        # Wall time in seconds spent in each stage of the job, i.e. waiting for a slot ("queue"), "filter", "cache",
+        # "export" and "write", and the "total" time since the job was started.
+        self.timings = timings
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@contextmanager
+def _measure(timings: dict, stage: str):
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+def _get_filtered_svg_data(document: SVGDocument, job: ExportJob, prune: bool, gc_defs: bool):
+    transformation_by_layer = {}
+
+    if job.layers is None:
+        if job.offsets:
+            raise UserError('Offsets can only be applied to selected layers.')
+
+        selected_layers = None
+    else:
+        for i in job.offsets:
+            if i not in job.layers:
+                raise UserError('Offset given for a pattern which is not used to select layers: {}'.format(i))
+
+        selected_layers = set()
+
+        for pattern, layers in zip(job.layers, select_layers(document.layers, job.layers)):
+            offset = job.offsets.get(pattern, (0, 0))
+
+            for i in layers:
+                selected_layers.add(i)
+
+                if offset != (0, 0):
+                    transformation_by_layer[i] = Transformation.from_offset(offset)
+
+    document = document.with_transformed_layers(transformation_by_layer)
+
+    if job.clip is None:
+        clip_layer = None
+    else:
+        clip_layer = get_layer(document.layers, job.clip)
+
+    return document.filtered_svg_data(selected_layers, clip_layer, prune, gc_defs)
+
+
+# Exports outputs from documents without blocking the event loop. At most `jobs` jobs run at the same time. The renderer
+# is run using asyncio, if the exporter supports it, and the other stages are run on the loop's default executor.
+#
+# Documents are modified while they are being filtered, so jobs are filtered one at a time. A document may only be
+# exported by one AsyncExporter at a time. The exporter must support being used from multiple threads, which
+# ShellExporter does not.
+class AsyncExporter:
+    default_jobs = 4
+
+    def __init__(
+            self, exporter: Exporter = None, jobs: int = default_jobs, cache: PDFCache = None, prune: bool = False,
+            gc_defs: bool = False):
+        if exporter is None:
+            exporter = OneShotExporter()
+
+        self.exporter = exporter
+        self.cache = cache
+        self.prune = prune
+        self.gc_defs = gc_defs
+
+        self._semaphore = asyncio.Semaphore(jobs)
+        self._filter_lock = asyncio.Lock()
+
+    def _fetch_cached(self, svg_data: bytes):
+        cache_key = self.cache.get_key(svg_data, self.exporter.cache_key)
+
+        return cache_key, self.cache.fetch_data(cache_key)
+
+    async def _run_job(self, document: SVGDocument, job: ExportJob, timings: dict):
+        loop = asyncio.get_running_loop()
+
+        async with self._filter_lock:
+            with _measure(timings, 'filter'):
+                future = loop.run_in_executor(None, _get_filtered_svg_data, document, job, self.prune, self.gc_defs)
+
+                try:
+                    svg_data = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # The thread cannot be stopped. Hold the lock until it has reverted its changes to the document,
+                    # even if the job is cancelled again.
+                    while not future.done():
+                        try:
+                            await asyncio.wait([future])
+                        except asyncio.CancelledError:
+                            pass
+
+                    raise
+
+        data = None
+
+        if self.cache is not None:
+            with _measure(timings, 'cache'):
+                cache_key, data = await loop.run_in_executor(None, self._fetch_cached, svg_data)
+
+        cached = data is not None
+
+        if not cached:
+            with _measure(timings, 'export'):
+                data = await self.exporter.export_pdf_data_async(svg_data)
+
+            if self.cache is not None:
+                with _measure(timings, 'cache'):
+                    await loop.run_in_executor(None, self.cache.store_data, cache_key, data)
+
+        with _measure(timings, 'write'):
+            await loop.run_in_executor(None, write_pdf_data, data, job.path)
+
+        return cached
+
+    # Runs the job and returns its result. Failures are reported through the result instead of being raised.
+    async def export(self, document: SVGDocument, job: ExportJob):
+        timings = {}
+        error = None
+        cached = False
+
+        with _measure(timings, 'total'):
+            with _measure(timings, 'queue'):
+                await self._semaphore.acquire()
+
+            try:
+                cached = await self._run_job(document, job, timings)
+            except UserError as e:
+                error = e
+            finally:
+                self._semaphore.release()
+
+        return ExportResult(job, error, cached, timings)
+
+    # Runs the jobs concurrently and returns their results in the same order.
+    async def export_many(self, document: SVGDocument, jobs: list):
+        return list(await asyncio.gather(*(self.export(document, i) for i in jobs)))
+
+
+_default_exporters_by_loop = weakref.WeakKeyDictionary()
+
+
+# Returns the exporter used by SVGDocument.export() and SVGDocument.export_many() when none is passed, which is shared
+# by all documents exported from the running event loop.
+def get_default_exporter():
+    loop = asyncio.get_running_loop()
+    exporter = _default_exporters_by_loop.get(loop)
+
+    if exporter is None:
+        exporter = AsyncExporter()
+        _default_exporters_by_loop[loop] = exporter
+
+    return exporter
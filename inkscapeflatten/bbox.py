@@ -0,0 +1,490 @@
+import math
+import re
+
+from lxml import etree
+
+from inkscapeflatten.paths import parse_path, parse_points
+from inkscapeflatten.references import index_nodes_by_id
+from inkscapeflatten.util import UserError
+from inkscapeflatten.vendored import cubicsuperpath, inkex, simplestyle, simpletransform
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_rect_tags = [inkex.addNS('rect', 'svg'), 'rect', inkex.addNS('image', 'svg'), 'image']
+_line_tags = [inkex.addNS('line', 'svg'), 'line']
+_ellipse_tags = [inkex.addNS('circle', 'svg'), 'circle', inkex.addNS('ellipse', 'svg'), 'ellipse']
+_text_tags = [inkex.addNS('text', 'svg'), 'text']
+_use_tags = [inkex.addNS('use', 'svg'), 'use']
+
+_length_pattern = re.compile(r'\s*([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)\s*([a-z]*|%)\s*$')
+
+# User units per unit of length.
+_units = {'': 1, 'px': 1, 'pt': 4 / 3, 'pc': 16, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96}
+
+# Rough font metrics relative to the font size, used to estimate the extent of text.
+_default_font_size = 16.
+_ascent = .8
+_descent = .2
+_average_advance = .6
+_anchor_offsets = {'start': 0, 'middle': .5, 'end': 1}
+
+
+# Converts a parsed path into a flat list of coordinates, 8 per cubic Bézier segment, and the first point of the path.
+# The segments are the same as the ones produced by cubicsuperpath.CubicSuperPath() but no nested lists are built.
+def _get_segment_coordinates(simple_path: list):
+    coordinates = []
+    first_point = None
+    previous = None
+
+    def add_superpoint(in_control, point, out_control):
+        nonlocal first_point, previous
+
+        if first_point is None:
+            # Not necessarily the point of the initial moveto, as arcs may not pass through their start point.
+            first_point = point
+
+        if previous is not None:
+            coordinates.extend(previous[0])
+            coordinates.extend(previous[1])
+            coordinates.extend(in_control)
+            coordinates.extend(point)
+
+        previous = point, out_control
+
+    start = last = last_control = None
+
+    for command, params in simple_path:
+        if command == 'M':
+            if last is not None:
+                add_superpoint(last_control, last, last)
+
+            previous = None
+            start = last = last_control = tuple(params)
+        elif command == 'L':
+            add_superpoint(last_control, last, last)
+            last = last_control = tuple(params)
+        elif command == 'C':
+            add_superpoint(last_control, last, params[:2])
+            last = tuple(params[4:])
+            last_control = tuple(params[2:4])
+        elif command == 'Q':
+            (x0, y0), (x1, y1), (x2, y2) = last, params[:2], params[2:]
+
+            add_superpoint(last_control, last, (1. / 3 * x0 + 2. / 3 * x1, 1. / 3 * y0 + 2. / 3 * y1))
+            last = x2, y2
+            last_control = 2. / 3 * x1 + 1. / 3 * x2, 2. / 3 * y1 + 1. / 3 * y2
+        elif command == 'A':
+            arc = cubicsuperpath.ArcToPath(list(last), params)
+            arc[0][0] = last_control
+
+            for in_control, point, out_control in arc[:-1]:
+                add_superpoint(in_control, point, out_control)
+
+            last = tuple(arc[-1][1])
+            last_control = tuple(arc[-1][0])
+        elif command == 'Z':
+            add_superpoint(last_control, last, last)
+            last = last_control = start
+
+    add_superpoint(last_control, last, last)
+
+    return coordinates, first_point
+
+
+class _Shapes:
+    def __init__(self):
+        # Lists of a transformation and the segment coordinates, points and ellipses (center and radii) to which the
+        # transformation still has to be applied. Consecutive shapes with the same transformation share an item.
+        self.items = []
+
+    def _get_item(self, mat: list):
+        if not self.items or self.items[-1][0] is not mat:
+            self.items.append([mat, [], [], []])
+
+        return self.items[-1]
+
+    def add_path(self, d: str, mat: list):
+        simple_path = parse_path(d)
+
+        if not simple_path:
+            return
+
+        coordinates, first_point = _get_segment_coordinates(simple_path)
+        item = self._get_item(mat)
+        item[1].extend(coordinates)
+        item[2].extend(first_point)
+
+    def add_points(self, points: list, mat: list):
+        if points:
+            self._get_item(mat)[2].extend(points)
+
+    def add_ellipse(self, cx: float, cy: float, rx: float, ry: float, mat: list):
+        self._get_item(mat)[3].extend([cx, cy, rx, ry])
+
+    def add_shapes(self, shapes: '_Shapes', mat: list):
+        # The lists are shared with the other instance. This is safe because no other shapes are added to these items,
+        # as their transformation is a new object.
+        for m, coordinates, points, ellipses in shapes.items:
+            self.items.append([simpletransform.composeTransform(mat, m), coordinates, points, ellipses])
+
+
+# Returns the value of an attribute containing a length in user units. Relative units cannot be resolved here.
+def _get_length(node, name: str, default: str = '0'):
+    value = node.get(name, default)
+
+    # Most lengths are plain numbers.
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    match = _length_pattern.match(value)
+
+    if match is None or match.group(2) not in _units:
+        element = '<{}>'.format(etree.QName(node).localname)
+
+        if node.get('id') is not None:
+            element += ' with ID {}'.format(node.get('id'))
+
+        raise UserError('Unsupported length in attribute {} of element {}: {}'.format(name, element, value))
+
+    number, unit = match.groups()
+
+    return float(number) * _units[unit]
+
+
+def _get_style_property(node, name: str):
+    return simplestyle.parseStyle(node.get('style')).get(name, node.get(name))
+
+
+def _get_font_size(node, inherited: float):
+    value = _get_style_property(node, 'font-size')
+    match = None if value is None else _length_pattern.match(value)
+
+    if match is None:
+        return inherited
+
+    number, unit = match.groups()
+
+    if unit in ['em', '%']:
+        return float(number) * inherited / (100 if unit == '%' else 1)
+
+    return float(number) * _units.get(unit, 1)
+
+
+# Estimates the extent of the text runs of a <text> element. The glyphs of the font are not available, so average
+# metrics are used and the result is only a rough estimate.
+def _add_text(shapes: _Shapes, node, mat: list):
+    points = []
+    pen_x = pen_y = 0.
+
+    def add_run(text, font_size, anchor):
+        nonlocal pen_x
+
+        if not text or text.isspace():
+            return
+
+        width = len(' '.join(text.split())) * _average_advance * font_size
+        x = pen_x - width * _anchor_offsets.get(anchor, 0)
+        top = pen_y - _ascent * font_size
+        bottom = pen_y + _descent * font_size
+
+        points.extend([x, top, x + width, top, x + width, bottom, x, bottom])
+        pen_x += width
+
+    def walk(node, font_size, anchor):
+        nonlocal pen_x, pen_y
+
+        # Only the first of multiple positions is used.
+        pen_x = next(iter(parse_points(node.get('x', ''))), pen_x)
+        pen_y = next(iter(parse_points(node.get('y', ''))), pen_y)
+
+        font_size = _get_font_size(node, font_size)
+        anchor = _get_style_property(node, 'text-anchor') or anchor
+
+        add_run(node.text, font_size, anchor)
+
+        for i in node:
+            if isinstance(i.tag, str):
+                walk(i, font_size, anchor)
+
+            add_run(i.tail, font_size, anchor)
+
+    walk(node, _default_font_size, 'start')
+    shapes.add_points(points, mat)
+
+
+# Adds the shape of a single element, if it has one. Basic shapes are added as their corner points or as ellipses
+# instead of being converted to path data.
+def _add_shape(shapes: _Shapes, node, mat: list):
+    tag = node.tag
+
+    if node.get('d'):
+        shapes.add_path(node.get('d'), mat)
+    elif node.get('points'):
+        points = parse_points(node.get('points'))
+
+        # Like in path data, points without a second coordinate are dropped.
+        shapes.add_points(points[:len(points) // 2 * 2], mat)
+    elif tag in _rect_tags:
+        x = _get_length(node, 'x')
+        y = _get_length(node, 'y')
+        width = _get_length(node, 'width')
+        height = _get_length(node, 'height')
+
+        shapes.add_points([x, y, x + width, y, x + width, y + height, x, y + height], mat)
+    elif tag in _line_tags:
+        points = [_get_length(node, 'x1'), _get_length(node, 'y1'), _get_length(node, 'x2'), _get_length(node, 'y2')]
+
+        shapes.add_points(points, mat)
+    elif tag in _ellipse_tags:
+        if node.get('r') is not None:
+            rx = ry = _get_length(node, 'r')
+        else:
+            rx = _get_length(node, 'rx', node.get('ry', '0'))
+            ry = _get_length(node, 'ry', node.get('rx', '0'))
+
+        shapes.add_ellipse(_get_length(node, 'cx'), _get_length(node, 'cy'), rx, ry, mat)
+    elif tag in _text_tags:
+        _add_text(shapes, node, mat)
+    else:
+        return False
+
+    return True
+
+
+# Applies the transformation to a flat array of coordinates. The operations are done in the same order as in
+# simpletransform.applyTransformToPoint() to get the same rounding.
+def _transform(mat: list, coordinates):
+    x = coordinates[0::2]
+    y = coordinates[1::2]
+
+    return numpy.stack([
+        mat[0][0] * x + mat[0][1] * y + mat[0][2],
+        mat[1][0] * x + mat[1][1] * y + mat[1][2]], axis=-1).reshape(-1)
+
+
+# Returns the bounds of all ellipses as a flat array of two corner points per ellipse. Unlike the bounding box of the
+# transformed center and radii, this is the exact extent of the transformed ellipse.
+def _transform_ellipses(mat: list, ellipses):
+    ellipses = ellipses.reshape(-1, 4)
+    centers = _transform(mat, ellipses[:, :2].reshape(-1)).reshape(-1, 2)
+    rx = ellipses[:, 2]
+    ry = ellipses[:, 3]
+    x_extents = numpy.hypot(mat[0][0] * rx, mat[0][1] * ry)
+    y_extents = numpy.hypot(mat[1][0] * rx, mat[1][1] * ry)
+
+    return numpy.stack([
+        centers[:, 0] - x_extents,
+        centers[:, 1] - y_extents,
+        centers[:, 0] + x_extents,
+        centers[:, 1] + y_extents], axis=-1).reshape(-1)
+
+
+def _get_href(node):
+    for name in [inkex.addNS('href', 'xlink'), 'href']:
+        value = node.get(name)
+
+        if value is not None:
+            return value
+
+    return None
+
+
+# Collects the shapes of elements and resolves <use> elements through an index of elements by ID. The shapes of each
+# referenced element are collected only once, in the coordinate system of the referencing <use> element, and reused for
+# all other references to it.
+class BBoxCalculator:
+    def __init__(self, nodes_by_id: dict = None):
+        self.nodes_by_id = nodes_by_id
+
+        self._shapes_by_node = {}
+        self._bbox_by_node = {}
+        self._resolving_nodes = set()
+
+    def _get_referenced_node(self, node):
+        href = _get_href(node)
+
+        if href is None or not href.startswith('#'):
+            return None
+
+        if self.nodes_by_id is None:
+            self.nodes_by_id = index_nodes_by_id(node.getroottree())
+
+        return self.nodes_by_id.get(href[1:])
+
+    def _get_referenced_shapes(self, node):
+        shapes = self._shapes_by_node.get(node)
+
+        if shapes is None:
+            shapes = _Shapes()
+
+            self._resolving_nodes.add(node)
+
+            try:
+                self._collect_shapes(shapes, [node], [[1, 0, 0], [0, 1, 0]])
+            finally:
+                self._resolving_nodes.remove(node)
+
+            self._shapes_by_node[node] = shapes
+
+        return shapes
+
+    def _get_referenced_bbox(self, node):
+        if node not in self._bbox_by_node:
+            self._bbox_by_node[node] = _get_bbox(self._get_referenced_shapes(node))
+
+        return self._bbox_by_node[node]
+
+    def _add_referenced_shapes(self, shapes: _Shapes, node, mat):
+        # A reference to an element which is currently being resolved would lead to infinite recursion. Such references
+        # are invalid and the element isn't rendered.
+        if node is None or node in self._resolving_nodes:
+            return
+
+        if mat[0][1] == 0 and mat[1][0] == 0:
+            # Under a transformation which only scales and translates, the transformed bounding box is the bounding box
+            # of the transformed shapes.
+            bbox = self._get_referenced_bbox(node)
+
+            if bbox is not None:
+                xmin, xmax, ymin, ymax = bbox
+                shapes.add_points([xmin, ymin, xmax, ymax], mat)
+        else:
+            shapes.add_shapes(self._get_referenced_shapes(node), mat)
+
+    def _collect_shapes(self, shapes: _Shapes, nodes, mat):
+        for node in nodes:
+            transform = node.get('transform')
+
+            # Reuse the same matrix for all elements without a transformation so that their shapes share an item.
+            if transform:
+                m = simpletransform.composeTransform(mat, simpletransform.parseTransform(transform))
+            else:
+                m = mat
+
+            if not _add_shape(shapes, node, m) and node.tag in _use_tags:
+                self._add_referenced_shapes(shapes, self._get_referenced_node(node), m)
+
+            self._collect_shapes(shapes, node, m)
+
+    # Returns the bounding box of the given elements as (xmin, xmax, ymin, ymax) or None if they have no shapes.
+    def compute_bbox(self, nodes, mat=[[1, 0, 0], [0, 1, 0]]):
+        shapes = _Shapes()
+        self._collect_shapes(shapes, nodes, mat)
+
+        return _get_bbox(shapes)
+
+
+# Returns the extrema of the cubic Bézier curves with the control values y0 to y3 along one axis, like
+# simpletransform.cubicExtrema() but for all segments at once.
+def _cubic_extrema(y0, y1, y2, y3):
+    d1 = y1 - y0
+    d2 = y2 - y1
+    d3 = y3 - y2
+    a = d1 - 2 * d2 + d3
+    discriminant = d2 * d2 - d1 * d3
+
+    def evaluate(t, valid):
+        valid &= (t > 0) & (t < 1)
+        t = numpy.where(valid, t, 0)
+        y = y0 * (1 - t) * (1 - t) * (1 - t) + 3 * y1 * t * (1 - t) * (1 - t) + 3 * y2 * t * t * (1 - t) + y3 * t * t * t
+
+        # Fall back to an endpoint, which is a candidate anyway.
+        return numpy.where(valid, y, y0)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        quadratic = (a != 0) & (discriminant > 0)
+        root = numpy.sqrt(numpy.where(quadratic, discriminant, 0))
+        linear = (a == 0) & (d3 - d1 != 0)
+
+        candidates = numpy.stack([
+            y0,
+            y3,
+            evaluate((d1 - d2 + root) / a, quadratic.copy()),
+            evaluate((d1 - d2 - root) / a, quadratic.copy()),
+            evaluate(-d1 / (d3 - d1), linear)])
+
+    return candidates.min(), candidates.max()
+
+
+def _get_bbox_numpy(shapes: _Shapes):
+    points = []
+    segments = []
+
+    for mat, coordinates, item_points, ellipses in shapes.items:
+        segments.append(_transform(mat, numpy.array(coordinates, dtype=float)))
+        points.append(_transform(mat, numpy.array(item_points, dtype=float)))
+        points.append(_transform_ellipses(mat, numpy.array(ellipses, dtype=float)))
+
+    points = numpy.concatenate(points).reshape(-1, 2)
+    xmin, xmax = points[:, 0].min(), points[:, 0].max()
+    ymin, ymax = points[:, 1].min(), points[:, 1].max()
+
+    segments = numpy.concatenate(segments).reshape(-1, 4, 2)
+
+    if len(segments):
+        segments_xmin, segments_xmax = _cubic_extrema(*segments[:, :, 0].T)
+        segments_ymin, segments_ymax = _cubic_extrema(*segments[:, :, 1].T)
+
+        xmin, xmax = min(xmin, segments_xmin), max(xmax, segments_xmax)
+        ymin, ymax = min(ymin, segments_ymin), max(ymax, segments_ymax)
+
+    return float(xmin), float(xmax), float(ymin), float(ymax)
+
+
+def _get_bbox_python(shapes: _Shapes):
+    xs = []
+    ys = []
+
+    for mat, coordinates, points, ellipses in shapes.items:
+        transformed = []
+
+        for i in range(0, len(coordinates), 2):
+            point = [coordinates[i], coordinates[i + 1]]
+            simpletransform.applyTransformToPoint(mat, point)
+            transformed.append(point)
+
+        for i in range(0, len(points), 2):
+            point = [points[i], points[i + 1]]
+            simpletransform.applyTransformToPoint(mat, point)
+            xs.append(point[0])
+            ys.append(point[1])
+
+        for i in range(0, len(ellipses), 4):
+            cx, cy, rx, ry = ellipses[i:i + 4]
+            center = [cx, cy]
+            simpletransform.applyTransformToPoint(mat, center)
+            x_extent = math.hypot(mat[0][0] * rx, mat[0][1] * ry)
+            y_extent = math.hypot(mat[1][0] * rx, mat[1][1] * ry)
+            xs.extend([center[0] - x_extent, center[0] + x_extent])
+            ys.extend([center[1] - y_extent, center[1] + y_extent])
+
+        for i in range(0, len(transformed), 4):
+            (x0, y0), (x1, y1), (x2, y2), (x3, y3) = transformed[i:i + 4]
+            xs.extend(simpletransform.cubicExtrema(x0, x1, x2, x3))
+            ys.extend(simpletransform.cubicExtrema(y0, y1, y2, y3))
+
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+# Computes the bounding box of the collected shapes. The extrema of all segments are solved for with NumPy array
+# operations if NumPy is installed.
+def _get_bbox(shapes: _Shapes):
+    if not shapes.items:
+        return None
+
+    if numpy is None:
+        return _get_bbox_python(shapes)
+
+    return _get_bbox_numpy(shapes)
+
+
+# Computes the same bounding box as simpletransform.computeBBox() (within floating point accuracy) for paths, except that
+# circles and ellipses get their exact extent and text is included. Referenced elements are looked up in nodes_by_id,
+# which is built from the document if not passed.
+def compute_bbox(nodes, mat=[[1, 0, 0], [0, 1, 0]], nodes_by_id: dict = None):
+    return BBoxCalculator(nodes_by_id).compute_bbox(nodes, mat)
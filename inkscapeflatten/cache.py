@@ -0,0 +1,133 @@
+import hashlib
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+
+def default_cache_dir():
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'inkscape-flatten'
+
+
+# Stores exported PDF files under a hash of the SVG data that was passed to Inkscape, so that unchanged outputs can be
+# produced without running Inkscape at all. The least recently used files are removed when the cache grows larger
+# than max_size bytes. Errors accessing the cache are reported as warnings, as exports also work without it.
+class PDFCache:
+    default_max_size = 1 << 30
+
+    def __init__(self, path: Path, max_size: int = default_max_size):
+        self.path = path
+        self.max_size = max_size
+
+        self._warned = False
+
+    # Only the first error is reported, as the cache directory is likely to be unusable for all outputs.
+    def _warn(self, error: OSError):
+        if not self._warned:
+            self._warned = True
+            print('Warning: Could not use the cache at {}: {}'.format(self.path, error), file=sys.stderr)
+
+    def get_key(self, svg_data: bytes, exporter_key: str):
+        hash = hashlib.sha256()
+        hash.update(exporter_key.encode())
+        hash.update(b'\0')
+        hash.update(svg_data)
+
+        return hash.hexdigest()
+
+    def _entry_path(self, key: str):
+        return self.path / '{}.pdf'.format(key)
+
+    def fetch(self, key: str, dest_path: Path):
+        entry_path = self._entry_path(key)
+
+        try:
+            # Marks the entry as recently used. As the entry may be hard-linked, this also makes the output file newer
+            # than its inputs.
+            os.utime(str(entry_path))
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            self._warn(e)
+
+            return False
+
+        if dest_path.exists():
+            dest_path.unlink()
+
+        try:
+            os.link(str(entry_path), str(dest_path))
+        except FileNotFoundError:
+            # Otherwise, the destination cannot be written.
+            if entry_path.exists():
+                raise
+
+            # Evicted concurrently.
+            return False
+        except OSError:
+            shutil.copyfile(str(entry_path), str(dest_path))
+
+        return True
+
+    # Returns the content of the entry or None, if there is no such entry.
+    def fetch_data(self, key: str):
+        entry_path = self._entry_path(key)
+
+        try:
+            os.utime(str(entry_path))
+
+            return entry_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self._warn(e)
+
+            return None
+
+    def store(self, key: str, pdf_path: Path):
+        self._store(key, lambda temp_path: shutil.copyfile(str(pdf_path), str(temp_path)))
+
+    def store_data(self, key: str, data: bytes):
+        self._store(key, lambda temp_path: temp_path.write_bytes(data))
+
+    def _store(self, key: str, write_fn):
+        temp_path = self.path / '{}.{}~'.format(key, uuid.uuid4().hex)
+
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+            try:
+                write_fn(temp_path)
+                temp_path.replace(self._entry_path(key))
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+
+            self._evict()
+        except OSError as e:
+            self._warn(e)
+
+    def _evict(self):
+        def iter_entries():
+            for i in self.path.glob('*.pdf'):
+                try:
+                    stat = i.stat()
+                except FileNotFoundError:
+                    continue
+
+                yield stat.st_mtime, stat.st_size, i
+
+        entries = sorted(iter_entries())
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
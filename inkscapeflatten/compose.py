@@ -0,0 +1,168 @@
+from pathlib import Path
+
+from inkscapeflatten.exporter import ExporterPool
+from inkscapeflatten.inkscape import SVGDocument, Layer, write_pdf, write_pdf_data
+from inkscapeflatten.pdf import PDFReader, PDFWriter, Page, write_pages
+from inkscapeflatten.timings import measure
+from inkscapeflatten.util import UserError
+from inkscapeflatten.vendored import simpletransform
+
+# Space added around the content of a rendered layer, relative to the size of the page. The bounding boxes don't
+# include strokes, markers or filters.
+_margin = .1
+
+
+# A layer, including its sublayers, which is rendered to a PDF file of its own.
+class _RenderedLayer:
+    def __init__(self, document: SVGDocument, layers: list, bounds: tuple, pdf_path: Path):
+        # The document, with transformations of sublayers applied, and the layers which are made visible in it.
+        self.document = document
+        self.layers = layers
+
+        # The part of the document shown on the page of the PDF file, as (xmin, xmax, ymin, ymax).
+        self.bounds = bounds
+        self.pdf_path = pdf_path
+
+        self._reader = None
+
+    def get_reader(self):
+        if self._reader is None:
+            self._reader = PDFReader.from_file(self.pdf_path)
+
+        return self._reader
+
+
+# A page of an output assembled from rendered layers, each of which is placed on the page with an offset in user units.
+class _ComposedPage:
+    def __init__(self, bounds: tuple, placements: list):
+        self.bounds = bounds
+
+        # List of (rendered layer, (offset x, offset y)) pairs, in the order in which they are stacked.
+        self.placements = placements
+
+
+# Assembles outputs from layers which are each rendered only once, no matter in how many outputs they are used. Each
+# selected layer is rendered together with its sublayers, unless it is a sublayer of another selected layer. Layers
+# moved by an offset are rendered without the offset, which is then applied when composing the output.
+#
+# Unlike rendering the combined layers, group effects of ancestors of multiple selected layers, e.g. opacity, are
+# applied to each of the layers separately.
+class LayerComposer:
+    def __init__(self, document: SVGDocument, temp_dir: Path, prune: bool = False, gc_defs: bool = False):
+        self.document = document
+        self.prune = prune
+        self.gc_defs = gc_defs
+
+        self._temp_dir = temp_dir
+        self._rendered_layers_by_key = {}
+        self._pending_rendered_layers = []
+
+    def _get_rendered_layer(self, layer: Layer, layers: list, transformations: list):
+        key = tuple(layers), repr([(i.path, j.m) for i, j in transformations])
+        rendered_layer = self._rendered_layers_by_key.get(key)
+
+        if rendered_layer is None:
+            document = self.document.with_transformed_layers(dict(transformations))
+            bounds = simpletransform.boxunion(document.get_page_bounds(), document.get_layer_bounds(layer))
+            xmin, xmax, ymin, ymax = bounds
+            margin = _margin * max(xmax - xmin, ymax - ymin)
+            bounds = xmin - margin, xmax + margin, ymin - margin, ymax + margin
+
+            pdf_path = self._temp_dir / 'layer-{}.pdf'.format(len(self._rendered_layers_by_key))
+            rendered_layer = _RenderedLayer(document, layers, bounds, pdf_path)
+
+            self._rendered_layers_by_key[key] = rendered_layer
+            self._pending_rendered_layers.append(rendered_layer)
+
+        return rendered_layer
+
+    # Returns a page showing the layers selected from a document returned by SVGDocument.with_transformed_layers(),
+    # clipped to the bounds of region or the page. The layers it uses are rendered by the next call to render().
+    def add_page(self, document: SVGDocument, layers: list = None, region: Layer = None):
+        if layers is None:
+            layers = [document.layers]
+
+        selected_layers = set(layers)
+        transformation_by_layer = dict(document.transformations)
+        placements = []
+
+        def walk(layer):
+            if layer in selected_layers:
+                sublayers = layer.flatten[1:]
+                transformations = [(i, transformation_by_layer[i]) for i in sublayers if i in transformation_by_layer]
+                shown_layers = [layer] + [i for i in sublayers if i in selected_layers]
+                rendered_layer = self._get_rendered_layer(layer, shown_layers, transformations)
+
+                transformation = transformation_by_layer.get(layer)
+
+                if transformation is None:
+                    offset = 0, 0
+                else:
+                    # Transformations are offsets applied in the coordinates of the parent layer.
+                    (a, b, _), (c, d, _) = self.document.get_parent_matrix(layer)
+                    (_, _, x), (_, _, y) = transformation.m
+                    offset = a * x + b * y, c * x + d * y
+
+                placements.append((rendered_layer, offset))
+            else:
+                for i in layer.values():
+                    walk(i)
+
+        walk(document.layers)
+
+        if region is None:
+            bounds = document.get_page_bounds()
+        else:
+            bounds = document.get_layer_bounds(region)
+
+            if bounds is None:
+                raise UserError('Clip layer has no content: {}'.format('/'.join(region.path)))
+
+        return _ComposedPage(bounds, placements)
+
+    # Submits the layers which have not been rendered yet to the pool.
+    def render(self, pool: ExporterPool, cache):
+        for i in self._pending_rendered_layers:
+            svg_data = i.document.filtered_svg_data(i.layers, None, self.prune, self.gc_defs, i.bounds)
+            pool.submit('/'.join(i.layers[0].path), write_pdf, svg_data, i.pdf_path, cache)
+
+        self._pending_rendered_layers = []
+
+    # Returns whether all layers used by the pages have been rendered successfully.
+    def is_rendered(self, pages: list):
+        return all(j.pdf_path.exists() for i in pages for j, _ in i.placements)
+
+    # Writes a PDF file with the pages, assembled from the rendered layers they use.
+    def write_output(self, path: Path, pages: list):
+        with measure('compose'):
+            writer = PDFWriter()
+            data = writer.to_bytes(write_pages(writer, [self._compose_page(writer, i) for i in pages]))
+
+        write_pdf_data(data, path)
+
+    def _compose_page(self, writer: PDFWriter, composed_page: _ComposedPage):
+        xmin, xmax, ymin, ymax = composed_page.bounds
+        page = None
+
+        for rendered_layer, (offset_x, offset_y) in composed_page.placements:
+            reader = rendered_layer.get_reader()
+            form, media_box = writer.import_page(reader, reader.get_pages()[0])
+
+            media_xmin, media_ymin, media_xmax, media_ymax = media_box
+            layer_xmin, layer_xmax, layer_ymin, layer_ymax = rendered_layer.bounds
+
+            # Points per user unit.
+            scale_x = (media_xmax - media_xmin) / (layer_xmax - layer_xmin)
+            scale_y = (media_ymax - media_ymin) / (layer_ymax - layer_ymin)
+
+            if page is None:
+                page = Page((xmax - xmin) * scale_x, (ymax - ymin) * scale_y)
+
+            # The y axis of PDF points up.
+            page.place(
+                form,
+                -media_xmin + (layer_xmin + offset_x - xmin) * scale_x,
+                -media_ymax + (ymax - layer_ymin - offset_y) * scale_y)
+
+        # At least one layer is placed on each page.
+        return page
@@ -0,0 +1,533 @@
+import asyncio
+import functools
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory, TemporaryFile
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from inkscapeflatten.images import default_image_dir
+from inkscapeflatten.timings import measure
+from inkscapeflatten.util import UserError
+
+
+# Running Inkscape takes a while, even for --version.
+@functools.lru_cache()
+def get_inkscape_version(executable: str):
+    try:
+        output = subprocess.run(
+            [executable, '--version'],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout
+    except (OSError, CalledProcessError):
+        return None
+
+    match = re.search(rb'Inkscape ([0-9]+)\.([0-9]+)', output)
+
+    if match is None:
+        return None
+
+    return int(match.group(1)), int(match.group(2))
+
+
+@functools.lru_cache()
+def get_rsvg_convert_version(executable: str):
+    try:
+        output = subprocess.run(
+            [executable, '--version'],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout
+    except (OSError, CalledProcessError):
+        return None
+
+    match = re.search(rb'version ([0-9.]+)', output)
+
+    if match is None:
+        return None
+
+    return match.group(1).decode()
+
+
+class ShellUnavailableError(Exception):
+    pass
+
+
+# Returns the output of the command, which is passed input on stdin.
+def _run_command(args: list, input: bytes = None):
+    try:
+        return subprocess.run(
+            args,
+            input=input,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE).stdout
+    except OSError as error:
+        raise UserError('Could not run {}: {}'.format(args[0], error))
+    except CalledProcessError as error:
+        sys.stderr.buffer.write(error.stderr)
+
+        raise UserError('Command failed: {}'.format(' '.join(args)))
+
+
+async def _run_command_async(args: list, input: bytes = None):
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+    except OSError as error:
+        raise UserError('Could not run {}: {}'.format(args[0], error))
+
+    try:
+        stdout, stderr = await process.communicate(input)
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+
+        raise
+
+    if process.returncode != 0:
+        sys.stderr.buffer.write(stderr)
+
+        raise UserError('Command failed: {}'.format(' '.join(args)))
+
+    return stdout
+
+
+# Base class of the backends which render SVG files to PDF files. The page of the PDF file has the size of the document.
+class Exporter:
+    # Identifies everything besides the SVG data that influences the generated PDF file.
+    @property
+    def cache_key(self):
+        raise NotImplementedError()
+
+    # Whether export_pdf_data() passes the data to the renderer without writing it to files.
+    @property
+    def can_pipe(self):
+        return False
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        raise NotImplementedError()
+
+    # Returns the PDF data rendered from the SVG data.
+    def export_pdf_data(self, svg_data: bytes):
+        with TemporaryDirectory() as temp_dir:
+            svg_path = Path(temp_dir) / 'document.svg'
+            pdf_path = Path(temp_dir) / 'document.pdf'
+            svg_path.write_bytes(svg_data)
+            self.export_pdf(svg_path, pdf_path)
+
+            return pdf_path.read_bytes()
+
+    # Like export_pdf_data(), but does not block the event loop. Subclasses which run a process override this to run it
+    # using asyncio. Otherwise, export_pdf_data() is called on a thread of the loop's default executor.
+    async def export_pdf_data_async(self, svg_data: bytes):
+        return await asyncio.get_running_loop().run_in_executor(None, self.export_pdf_data, svg_data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Starts a new Inkscape process for every exported file. With Inkscape 1.x, the SVG data is passed on stdin and the PDF
+# data is read from stdout.
+class OneShotExporter(Exporter):
+    def __init__(self, executable: str = 'inkscape'):
+        self.executable = executable
+
+    @property
+    def can_pipe(self):
+        version = get_inkscape_version(self.executable)
+
+        return version is not None and version >= (1, 0)
+
+    @property
+    def cache_key(self):
+        version = get_inkscape_version(self.executable)
+
+        return 'inkscape {} pdf export-area-page'.format('unknown' if version is None else '.'.join(map(str, version)))
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        version = get_inkscape_version(self.executable)
+
+        # Inkscape 1.x removed --export-pdf.
+        if version is not None and version >= (1, 0):
+            export_args = ['--export-type=pdf', '--export-filename={}'.format(pdf_path)]
+        else:
+            export_args = ['--export-pdf', str(pdf_path)]
+
+        _run_command([self.executable, '--export-area-page', *export_args, str(svg_path)])
+
+    @property
+    def _pipe_args(self):
+        return [self.executable, '--pipe', '--export-area-page', '--export-type=pdf', '--export-filename=-']
+
+    def export_pdf_data(self, svg_data: bytes):
+        if not self.can_pipe:
+            return super().export_pdf_data(svg_data)
+
+        return _run_command(self._pipe_args, svg_data)
+
+    async def export_pdf_data_async(self, svg_data: bytes):
+        # Probing the version runs Inkscape the first time.
+        can_pipe = await asyncio.get_running_loop().run_in_executor(None, lambda: self.can_pipe)
+
+        if not can_pipe:
+            return await super().export_pdf_data_async(svg_data)
+
+        return await _run_command_async(self._pipe_args, svg_data)
+
+
+# Keeps a single Inkscape 1.x process running in --shell mode and feeds it one line of actions per exported file.
+class ShellExporter(OneShotExporter):
+    _prompt = b'> '
+
+    # The shell can only read files.
+    @property
+    def can_pipe(self):
+        return False
+
+    def __init__(self, executable: str = 'inkscape'):
+        super().__init__(executable)
+
+        # None after the shell exited and could not be started again.
+        self._process = None
+
+        self._start()
+
+    def _start(self):
+        stderr_file = TemporaryFile()
+
+        try:
+            process = subprocess.Popen(
+                [self.executable, '--shell'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file)
+        except OSError as e:
+            stderr_file.close()
+
+            raise ShellUnavailableError(str(e))
+
+        self._process = process
+        self._stderr_file = stderr_file
+
+        try:
+            self._read_until_prompt()
+        except UserError as e:
+            self._stop()
+            self._process = None
+
+            raise ShellUnavailableError(str(e))
+
+    def _write_stderr(self):
+        self._stderr_file.seek(0)
+        sys.stderr.buffer.write(self._stderr_file.read())
+
+    def _read_until_prompt(self):
+        output = b''
+
+        while not output.endswith(self._prompt):
+            data = os.read(self._process.stdout.fileno(), 4096)
+
+            if not data:
+                raise UserError('Inkscape shell exited unexpectedly.')
+
+            output += data
+
+        return output
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        # Replace a shell which exited, e.g. because Inkscape crashed while exporting the previous file.
+        if self._process is not None and self._process.poll() is not None:
+            self._stop()
+            self._process = None
+
+            try:
+                self._start()
+            except ShellUnavailableError:
+                pass
+
+        # The shell splits its input at semicolons and has no way of quoting them.
+        if self._process is None or ';' in str(svg_path):
+            return super().export_pdf(svg_path, pdf_path)
+
+        # Let Inkscape write next to the SVG file so that it does not append an extension to our temporary file name.
+        shell_pdf_path = svg_path.with_suffix('.pdf')
+
+        if shell_pdf_path.exists():
+            shell_pdf_path.unlink()
+
+        command = 'file-open:{}; export-filename:{}; export-type:pdf; export-area-page; export-do; file-close\n'.format(
+            svg_path.resolve(), shell_pdf_path.resolve())
+
+        self._stderr_file.seek(0)
+        self._stderr_file.truncate()
+
+        try:
+            self._process.stdin.write(command.encode())
+            self._process.stdin.flush()
+            self._read_until_prompt()
+        except (OSError, UserError):
+            self._write_stderr()
+
+            # The shell may not have been reaped yet. Wait for it, so that it is replaced on the next export.
+            self._stop()
+
+            raise UserError('Inkscape shell exited unexpectedly while exporting: {}'.format(svg_path))
+
+        if not shell_pdf_path.exists():
+            self._write_stderr()
+
+            raise UserError('Inkscape shell failed to export: {}'.format(svg_path))
+
+        try:
+            shutil.move(str(shell_pdf_path), str(pdf_path))
+        except OSError as e:
+            raise UserError('Could not write PDF file {}: {}'.format(pdf_path, e))
+
+    def _stop(self):
+        if self._process.poll() is None:
+            try:
+                self._process.stdin.write(b'quit\n')
+                self._process.stdin.close()
+            except OSError:
+                pass
+
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+
+        try:
+            self._process.stdin.close()
+        except OSError:
+            # The shell exited before reading everything written to it.
+            pass
+
+        self._process.stdout.close()
+        self._stderr_file.close()
+
+    def close(self):
+        if self._process is not None:
+            self._stop()
+
+
+# Renders using rsvg-convert from librsvg, which starts much faster than Inkscape but does not support some Inkscape
+# specific features, e.g. flowed text.
+class RsvgExporter(Exporter):
+    def __init__(self, executable: str = 'rsvg-convert'):
+        self.executable = executable
+
+    @property
+    def cache_key(self):
+        return 'rsvg-convert {} pdf'.format(get_rsvg_convert_version(self.executable) or 'unknown')
+
+    @property
+    def can_pipe(self):
+        return True
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        _run_command([self.executable, '--format=pdf', '--output={}'.format(pdf_path), str(svg_path)])
+
+    def export_pdf_data(self, svg_data: bytes):
+        return _run_command([self.executable, '--format=pdf'], svg_data)
+
+    async def export_pdf_data_async(self, svg_data: bytes):
+        return await _run_command_async([self.executable, '--format=pdf'], svg_data)
+
+
+# Renders in-process using CairoSVG, which is an optional dependency. Like rsvg-convert, it does not support some
+# Inkscape specific features.
+class CairoSVGExporter(Exporter):
+    def __init__(self):
+        try:
+            import cairosvg
+        except ImportError:
+            raise UserError('The cairosvg backend requires the cairosvg package to be installed.')
+
+        self._cairosvg = cairosvg
+        self._image_dir = default_image_dir().resolve()
+
+        # Since version 2.7, the default fetcher only loads data URIs.
+        self._default_fetch_url = getattr(cairosvg.url, 'safe_fetch', cairosvg.url.fetch)
+
+    @property
+    def cache_key(self):
+        return 'cairosvg {} pdf'.format(self._cairosvg.__version__)
+
+    # Additionally allows loading the images written by --externalize-images.
+    def _fetch_url(self, url: str, resource_type: str):
+        parsed_url = urlparse(url)
+
+        if parsed_url.scheme == 'file':
+            path = Path(url2pathname(parsed_url.path)).resolve()
+
+            if self._image_dir in path.parents:
+                return path.read_bytes()
+
+        return self._default_fetch_url(url, resource_type)
+
+    def _convert(self, **kwargs):
+        return self._cairosvg.surface.PDFSurface.convert(url_fetcher=self._fetch_url, **kwargs)
+
+    @property
+    def can_pipe(self):
+        return True
+
+    def export_pdf(self, svg_path: Path, pdf_path: Path):
+        try:
+            # Passed as a file, as a URL would be loaded through _fetch_url().
+            with svg_path.open('rb') as file:
+                self._convert(file_obj=file, write_to=str(pdf_path))
+        except Exception as e:
+            raise UserError('CairoSVG failed to export {}: {}'.format(svg_path, e))
+
+    def export_pdf_data(self, svg_data: bytes):
+        try:
+            return self._convert(bytestring=svg_data)
+        except Exception as e:
+            raise UserError('CairoSVG failed to export: {}'.format(e))
+
+
+def _open_inkscape_exporter(executable: str):
+    # Only Inkscape 1.x has a shell that accepts actions. Fall back to running Inkscape once per file otherwise.
+    version = get_inkscape_version(executable)
+
+    if version is not None and version >= (1, 0):
+        try:
+            return ShellExporter(executable)
+        except ShellUnavailableError:
+            pass
+
+    return OneShotExporter(executable)
+
+
+def _open_inkscape_pipe_exporter(executable: str):
+    return OneShotExporter(executable)
+
+
+def _open_rsvg_exporter(executable: str):
+    return RsvgExporter()
+
+
+def _open_cairosvg_exporter(executable: str):
+    return CairoSVGExporter()
+
+
+# Functions creating an exporter for each backend, which are passed the Inkscape executable.
+backends = {
+    'inkscape': _open_inkscape_exporter,
+    'inkscape-pipe': _open_inkscape_pipe_exporter,
+    'rsvg': _open_rsvg_exporter,
+    'cairosvg': _open_cairosvg_exporter}
+
+
+def open_exporter(executable: str = 'inkscape', backend: str = 'inkscape'):
+    return backends[backend](executable)
+
+
+# Runs exports on a bounded number of threads, each of which owns its own exporter. Failed jobs are collected instead of
+# stopping the remaining jobs.
+class ExporterPool:
+    def __init__(self, executable: str = 'inkscape', jobs: int = 1, backend: str = 'inkscape'):
+        self.executable = executable
+        self.backend = backend
+
+        self._executor = ThreadPoolExecutor(jobs)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._exporters = []
+        self._errors = []
+        self._futures = []
+        self._job_count = 0
+
+        # Limit the number of jobs waiting for a worker, as each of them holds a serialized copy of the document.
+        self._pending_slots = threading.BoundedSemaphore(2 * jobs)
+
+    def _get_exporter(self):
+        exporter = getattr(self._local, 'exporter', None)
+
+        if exporter is None:
+            with measure('start exporter'):
+                exporter = open_exporter(self.executable, self.backend)
+            self._local.exporter = exporter
+
+            with self._lock:
+                self._exporters.append(exporter)
+
+        return exporter
+
+    def _add_error(self, name: str, error: UserError):
+        with self._lock:
+            self._errors.append((name, error))
+
+    # Record a job which failed before it could be submitted.
+    def add_error(self, name: str, error: UserError):
+        self._job_count += 1
+        self._add_error(name, error)
+
+    def submit(self, name: str, fn, *args):
+        def run():
+            try:
+                fn(*args, exporter=self._get_exporter())
+            except UserError as e:
+                self._add_error(name, e)
+            finally:
+                self._pending_slots.release()
+
+        self._job_count += 1
+        self._pending_slots.acquire()
+        self._futures.append(self._executor.submit(run))
+
+    # Waits for all submitted jobs. The pool can be used for more jobs afterwards.
+    def wait(self):
+        futures.wait(self._futures)
+
+        submitted_futures = self._futures
+        errors = self._errors
+        job_count = self._job_count
+
+        self._futures = []
+        self._errors = []
+        self._job_count = 0
+
+        # Re-raise unexpected exceptions from the worker threads.
+        for i in submitted_futures:
+            i.result()
+
+        if job_count == 1 and errors:
+            raise errors[0][1]
+        elif errors:
+            raise UserError(
+                '{} of the outputs failed:\n'.format(len(errors))
+                + '\n'.join('{}: {}'.format(name, error) for name, error in errors))
+
+    def close(self):
+        self._executor.shutdown()
+
+        for i in self._exporters:
+            i.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
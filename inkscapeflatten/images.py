@@ -0,0 +1,90 @@
+import base64
+import binascii
+import hashlib
+import re
+import uuid
+from pathlib import Path
+
+from lxml.etree import ElementTree
+
+from inkscapeflatten.cache import default_cache_dir
+from inkscapeflatten.util import UserError
+
+_image_tags = ['{http://www.w3.org/2000/svg}image', 'image']
+_href_attributes = ['{http://www.w3.org/1999/xlink}href', 'href']
+
+_data_uri_pattern = re.compile(r'\s*data:(?P<type>[^;,]+)(;[^;,]*)*;base64,', re.IGNORECASE)
+
+# File name extensions of the image types which are externalized. Images of other types are left embedded.
+_extensions_by_type = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/gif': 'gif',
+    'image/bmp': 'bmp',
+    'image/webp': 'webp',
+    'image/svg+xml': 'svg'}
+
+
+def default_image_dir():
+    return default_cache_dir() / 'images'
+
+
+# Writes the image to a file in image_dir named after the hash of its data, unless it already exists, and returns the
+# path of the file.
+def _store_image(image_dir: Path, data: bytes, extension: str):
+    image_path = image_dir / '{}.{}'.format(hashlib.sha256(data).hexdigest(), extension)
+
+    if not image_path.exists():
+        try:
+            image_dir.mkdir(parents=True, exist_ok=True)
+
+            temp_path = image_dir / '{}.{}~'.format(image_path.name, uuid.uuid4().hex)
+            temp_path.write_bytes(data)
+            temp_path.replace(image_path)
+        except OSError as e:
+            raise UserError('Could not write image to {}: {}'.format(image_dir, e))
+
+    return image_path
+
+
+# Replaces the base64 data URIs of <image> elements with file URIs of images stored in image_dir. Each distinct image is
+# stored once, under the hash of its data, so that identical images are shared within and across documents. Returns the
+# number of replaced data URIs.
+def externalize_images(tree: ElementTree, image_dir: Path):
+    uris_by_data_uri = {}
+    count = 0
+
+    for node in tree.iter(*_image_tags):
+        for name in _href_attributes:
+            data_uri = node.get(name)
+
+            if data_uri is None:
+                continue
+
+            uri = uris_by_data_uri.get(data_uri)
+
+            if uri is None:
+                match = _data_uri_pattern.match(data_uri)
+
+                if match is None:
+                    continue
+
+                extension = _extensions_by_type.get(match.group('type').lower())
+
+                if extension is None:
+                    continue
+
+                try:
+                    # Inkscape may break the data into multiple lines, which are ignored when decoding.
+                    data = base64.b64decode(data_uri[match.end():])
+                except binascii.Error:
+                    continue
+
+                uri = _store_image(image_dir, data, extension).resolve().as_uri()
+                uris_by_data_uri[data_uri] = uri
+
+            node.set(name, uri)
+            count += 1
+
+    return count
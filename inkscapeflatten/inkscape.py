@@ -1,28 +1,39 @@
 import copy
+import hashlib
+import itertools
 import re
-import subprocess
 import sys
 from collections.abc import Mapping
 from contextlib import contextmanager
 from pathlib import Path
-from subprocess import CalledProcessError
 from tempfile import TemporaryDirectory
 
 from lxml import etree
 from lxml.etree import ElementTree, Element, XMLParser
 
-from inkscapeflatten.util import UserError
+from inkscapeflatten.bbox import BBoxCalculator
+from inkscapeflatten.cache import PDFCache
+from inkscapeflatten.exporter import Exporter, OneShotExporter
+from inkscapeflatten.images import externalize_images
+from inkscapeflatten.pdf import concatenate_files
+from inkscapeflatten.references import find_referenced_nodes, index_nodes_by_id
+from inkscapeflatten.timings import measure
+from inkscapeflatten.util import UserError, is_stdio_path
 from inkscapeflatten.vendored import simplestyle, simpletransform
 
 
+_layer_tag = '{http://www.w3.org/2000/svg}g'
+_groupmode_attribute = '{http://www.inkscape.org/namespaces/inkscape}groupmode'
+_label_attribute = '{http://www.inkscape.org/namespaces/inkscape}label'
+
+
 def _gather_layers(tree: ElementTree):
     def walk_layer(id, path, element):
-        nodes = element.findall(
-            '{http://www.w3.org/2000/svg}g[@{http://www.inkscape.org/namespaces/inkscape}groupmode="layer"]')
+        nodes = element.findall('{}[@{}="layer"]'.format(_layer_tag, _groupmode_attribute))
 
         def iter_children():
             for node in nodes:
-                name = node.get('{http://www.inkscape.org/namespaces/inkscape}label')
+                name = node.get(_label_attribute)
                 id = node.get('id')
 
                 # Make sure that every layer has an ID. Otherwise we're screwed, because we won't be able to find the element again later.
@@ -35,12 +46,48 @@ def _gather_layers(tree: ElementTree):
     return walk_layer(None, [], tree)
 
 
-def _get_layer_node(tree: ElementTree, layer: 'Layer'):
+# Yields the path of each layer of an SVG file in the same order as Layer.flatten, without the root layer. Reads from
+# stdin, if the path is "-". The file is parsed incrementally and elements are discarded as soon as they have been
+# parsed, so that memory use does not grow with the size of the file.
+def iter_layer_paths(path: Path):
+    # Contains the path of each open element that is a layer or the root, and None for other elements.
+    open_layer_paths = []
+
+    try:
+        source = sys.stdin.buffer if is_stdio_path(path) else str(path)
+
+        for event, element in etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+            if event == 'start':
+                if not open_layer_paths:
+                    layer_path = []
+                elif open_layer_paths[-1] is not None \
+                        and element.tag == _layer_tag and element.get(_groupmode_attribute) == 'layer':
+                    layer_path = open_layer_paths[-1] + [element.get(_label_attribute)]
+
+                    yield layer_path
+                else:
+                    layer_path = None
+
+                open_layer_paths.append(layer_path)
+            else:
+                open_layer_paths.pop()
+
+                # Free the element and everything that was parsed before it.
+                element.clear()
+                parent = element.getparent()
+
+                if parent is not None:
+                    while element.getprevious() is not None:
+                        del parent[0]
+    except (OSError, etree.XMLSyntaxError) as e:
+        raise UserError('Could not read SVG file {}: {}'.format(path, e))
+
+
+def _get_layer_node(tree: ElementTree, nodes_by_id: dict, layer: 'Layer'):
     if layer.id is None:
         node = tree.getroot()
     else:
-        # FIXME: ID should be escaped here.
-        node = tree.find('.//*[@id="{}"]'.format(layer.id))
+        node = nodes_by_id.get(layer.id)
 
     assert node is not None
 
@@ -59,7 +106,42 @@ def _get_ancestor_nodes(node: Element):
     return list(_iter_ancestor_nodes())
 
 
-def _set_style(node, name, value):
+# Records changes made to attributes of a tree so that they can be reverted after the modified tree has been
+# serialized. This is used instead of modifying a copy of the whole tree.
+class _Overlay:
+    def __init__(self):
+        self._original_values = {}
+        self._removed_nodes = []
+
+    def set(self, node: Element, name: str, value: str):
+        key = node, name
+
+        if key not in self._original_values:
+            self._original_values[key] = node.get(name)
+
+        node.set(name, value)
+
+    def remove(self, node: Element):
+        parent = node.getparent()
+
+        self._removed_nodes.append((parent, parent.index(node), node))
+        parent.remove(node)
+
+    def revert(self):
+        for parent, index, node in reversed(self._removed_nodes):
+            parent.insert(index, node)
+
+        for (node, name), value in self._original_values.items():
+            if value is None:
+                del node.attrib[name]
+            else:
+                node.set(name, value)
+
+        self._original_values.clear()
+        self._removed_nodes.clear()
+
+
+def _set_style(overlay: _Overlay, node, name, value):
     style = simplestyle.parseStyle(node.get('style'))
 
     if value is not None:
@@ -67,52 +149,196 @@ def _set_style(node, name, value):
     elif name in style:
         del style[name]
 
-    node.set('style', simplestyle.formatStyle(style))
+    overlay.set(node, 'style', simplestyle.formatStyle(style))
 
 
-def _hide_deselected_layers(tree: ElementTree, layers: list):
+def _hide_deselected_layers(overlay: _Overlay, tree: ElementTree, nodes_by_id: dict, layers: list):
     # We need to select at least one layer.
     assert layers
 
-    tree = copy.deepcopy(tree)
-
     selected_nodes = set()
     selected_nodes_ancestors = set()
 
     for layer in layers:
-        ancestors_nodes = _get_ancestor_nodes(_get_layer_node(tree, layer))
+        ancestors_nodes = _get_ancestor_nodes(_get_layer_node(tree, nodes_by_id, layer))
 
         selected_nodes.add(ancestors_nodes[0])
         selected_nodes_ancestors.update(ancestors_nodes)
 
+    hidden_nodes = []
+
     # Hide siblings of all nodes along the path from a selected layer to the root.
     for i in selected_nodes_ancestors - selected_nodes:
         for node in i.findall('*'):
-            _set_style(node, 'display', 'none')
+            _set_style(overlay, node, 'display', 'none')
+
+            if node not in selected_nodes_ancestors:
+                hidden_nodes.append(node)
 
     # Unhide all nodes along the path from a selected layer to the root.
     for i in selected_nodes_ancestors:
-        _set_style(i, 'display', None)
+        _set_style(overlay, i, 'display', None)
+
+    return hidden_nodes
+
+
+# Elements which have an effect on the document even when they are hidden.
+_unprunable_tags = {'{http://www.w3.org/2000/svg}' + i for i in ['defs', 'style', 'script']}
+
+
+def _is_prunable(node: Element):
+    return node.tag.startswith('{http://www.w3.org/2000/svg}') and node.tag not in _unprunable_tags
+
+
+_defs_tag = '{http://www.w3.org/2000/svg}defs'
+
+
+# Removes content which does not contribute to the rendered document. With prune_hidden, hidden nodes are removed and
+# with gc_defs, the content of <defs> elements is removed. Content that is referenced from the visible part of the
+# document is kept in both cases, e.g. when used by a <use> element or through a url(#...) to a gradient, clip path,
+# mask or filter. Returns the removed content of <defs> elements.
+def _remove_unreferenced_nodes(
+        overlay: _Overlay, tree: ElementTree, nodes_by_id: dict, hidden_nodes: list, prune_hidden: bool,
+        gc_defs: bool):
+    hidden_nodes_set = set(hidden_nodes)
+
+    def iter_visible_nodes():
+        pending_nodes = [tree.getroot()]
+
+        while pending_nodes:
+            node = pending_nodes.pop()
+
+            # Hidden nodes which cannot be pruned still need their references.
+            if node in hidden_nodes_set and _is_prunable(node):
+                continue
+
+            yield node
+
+            # With gc_defs, content of <defs> elements only needs to be kept if it is referenced.
+            if not (gc_defs and node.tag == _defs_tag):
+                pending_nodes.extend(node.iterchildren(tag=etree.Element))
+
+    referenced_nodes = find_referenced_nodes(iter_visible_nodes(), nodes_by_id)
+
+    # Referenced nodes need their ancestors but not their siblings.
+    referenced_nodes_ancestors = set()
+
+    for i in referenced_nodes:
+        referenced_nodes_ancestors.update(_get_ancestor_nodes(i))
+
+    removed_defs_nodes = []
+
+    # The content of <defs> elements is only removed with gc_defs, unless it is part of a removed hidden node.
+    def remove(node, keep_defs):
+        if node in referenced_nodes:
+            pass
+        elif keep_defs and node.tag == _defs_tag:
+            pass
+        elif node in referenced_nodes_ancestors:
+            for i in list(node.iterchildren(tag=etree.Element)):
+                remove(i, keep_defs)
+        elif _is_prunable(node):
+            if node.getparent().tag == _defs_tag:
+                removed_defs_nodes.append(node)
+
+            overlay.remove(node)
+
+    if prune_hidden:
+        for i in hidden_nodes:
+            remove(i, True)
 
-    return tree
+    if gc_defs:
+        # Includes <defs> elements within hidden nodes which have not been pruned. Nested <defs> elements are handled
+        # together with the outermost one.
+        defs_nodes = [i for i in tree.iter(_defs_tag) if next(i.iterancestors(_defs_tag), None) is None]
 
+        for i in defs_nodes:
+            for j in list(i.iterchildren(tag=etree.Element)):
+                remove(j, False)
 
-def _transform_layer(tree: ElementTree, layer: 'Layer', transformation: 'Transformation'):
-    node = _get_layer_node(tree, layer)
+    return removed_defs_nodes
 
-    simpletransform.applyTransformToNode(transformation.m, node)
 
+def _print_removed_defs_stats(removed_nodes: list):
+    element_count = sum(1 for i in removed_nodes for _ in i.iter(tag=etree.Element))
+    byte_count = sum(len(etree.tostring(i)) for i in removed_nodes)
 
-def _adjust_view_box(svg_element: Element, bounds):
-    # "parse" in biq air-quotes.
-    def parse_measure(measure):
-        value, unit = re.match(r'(.+?)(\w+)$', measure).groups()
+    print(
+        'Removed {} unreferenced elements ({} bytes) from <defs>.'.format(element_count, byte_count),
+        file=sys.stderr)
 
-        return float(value), unit
 
-    width, width_unit = parse_measure(svg_element.get('width'))
-    height, height_unit = parse_measure(svg_element.get('height'))
-    old_xmin, old_ymin, old_xsize, old_ysize = map(float, svg_element.get('viewBox').split())
+def _transform_layer(
+        overlay: _Overlay, tree: ElementTree, nodes_by_id: dict, layer: 'Layer', transformation: 'Transformation'):
+    node = _get_layer_node(tree, nodes_by_id, layer)
+    m = simpletransform.parseTransform(node.get('transform'))
+
+    overlay.set(
+        node,
+        'transform',
+        simpletransform.formatTransform(simpletransform.composeTransform(transformation.m, m)))
+
+
+_measure_pattern = re.compile(r'\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)\s*([a-zA-Z%]*)\s*$')
+
+
+# Splits a length like "80mm" into its value and unit.
+def _parse_measure(measure: str):
+    match = _measure_pattern.match(measure or '')
+
+    if match is None:
+        raise UserError('Invalid length: {}'.format(measure))
+
+    value, unit = match.groups()
+
+    return float(value), unit
+
+
+# Size of a user unit in each of the units of absolute lengths.
+_pixels_per_unit = {'': 1, 'px': 1, 'pt': 4 / 3, 'pc': 16, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96}
+
+
+# Returns the view box of the root element as (xmin, ymin, xsize, ysize). Without a viewBox attribute, it is derived
+# from the width and height of the document.
+def _get_view_box(svg_element: Element):
+    view_box = svg_element.get('viewBox')
+
+    if view_box is None:
+        def get_size(name):
+            value, unit = _parse_measure(svg_element.get(name))
+
+            if unit not in _pixels_per_unit:
+                raise UserError('Unsupported unit in {} of the document: {}'.format(name, svg_element.get(name)))
+
+            return value * _pixels_per_unit[unit]
+
+        return 0, 0, get_size('width'), get_size('height')
+
+    try:
+        xmin, ymin, xsize, ysize = map(float, view_box.replace(',', ' ').split())
+    except ValueError:
+        raise UserError('Invalid viewBox of the document: {}'.format(view_box))
+
+    if xsize <= 0 or ysize <= 0:
+        raise UserError('Invalid viewBox of the document: {}'.format(view_box))
+
+    return xmin, ymin, xsize, ysize
+
+
+def _adjust_view_box(overlay: _Overlay, svg_element: Element, bounds):
+    old_xmin, old_ymin, old_xsize, old_ysize = _get_view_box(svg_element)
+
+    # Without a width or height, the size of the view box is used, in pixels.
+    def get_size(name, default):
+        value = svg_element.get(name)
+
+        if value is None:
+            return default, ''
+
+        return _parse_measure(value)
+
+    width, width_unit = get_size('width', old_xsize)
+    height, height_unit = get_size('height', old_ysize)
 
     xmin, xmax, ymin, ymax = bounds
     xsize = xmax - xmin
@@ -121,19 +347,83 @@ def _adjust_view_box(svg_element: Element, bounds):
     width *= xsize / old_xsize
     height *= ysize / old_ysize
 
-    svg_element.set('width', '{}{}'.format(width, width_unit))
-    svg_element.set('height', '{}{}'.format(height, height_unit))
-    svg_element.set('viewBox', '{} {} {} {}'.format(xmin, ymin, xsize, ysize))
+    overlay.set(svg_element, 'width', '{}{}'.format(width, width_unit))
+    overlay.set(svg_element, 'height', '{}{}'.format(height, height_unit))
+    overlay.set(svg_element, 'viewBox', '{} {} {} {}'.format(xmin, ymin, xsize, ysize))
+
+
+# Computes the bounds of all layers in one pass. The bounds of each layer are the union of the bounds of its child
+# layers and its other content.
+def _compute_layer_bounds(tree: ElementTree, nodes_by_id: dict, root_layer: 'Layer'):
+    bounds_by_layer = {}
+    bbox_calculator = BBoxCalculator(nodes_by_id)
+
+    def walk(layer, mat):
+        node = _get_layer_node(tree, nodes_by_id, layer)
+        child_layers_by_node = {_get_layer_node(tree, nodes_by_id, i): i for i in layer.values()}
+
+        bounds = bbox_calculator.compute_bbox([i for i in node if i not in child_layers_by_node], mat)
+
+        for child_node, child_layer in child_layers_by_node.items():
+            child_mat = simpletransform.composeTransform(
+                mat,
+                simpletransform.parseTransform(child_node.get('transform')))
+
+            bounds = simpletransform.boxunion(walk(child_layer, child_mat), bounds)
+
+        bounds_by_layer[layer] = bounds
+
+        return bounds
+
+    walk(root_layer, [[1, 0, 0], [0, 1, 0]])
+
+    return bounds_by_layer
+
+
+# Elements which don't contribute to the rendering of the layer which contains them. The content of <defs> elements is
+# only included in digests if it is referenced.
+_unrendered_tags = {
+    '{http://www.w3.org/2000/svg}defs',
+    '{http://www.w3.org/2000/svg}metadata',
+    '{http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd}namedview'}
+
+_style_tag = '{http://www.w3.org/2000/svg}style'
+
+
+def _update_digest(hash, node: Element):
+    hash.update(repr(sorted(node.attrib.items())).encode())
+
+
+# Computes a digest of the content of each layer in one pass. The digest of each layer is computed from the attributes
+# of the layer's element, its other content and the digests of its child layers.
+def _compute_layer_digests(tree: ElementTree, nodes_by_id: dict, root_layer: 'Layer'):
+    digests_by_layer = {}
+
+    def walk(layer):
+        node = _get_layer_node(tree, nodes_by_id, layer)
+        child_layers_by_node = {_get_layer_node(tree, nodes_by_id, i): i for i in layer.values()}
+
+        hash = hashlib.sha256()
+        _update_digest(hash, node)
 
+        for i in node:
+            if i in child_layers_by_node:
+                hash.update(walk(child_layers_by_node[i]))
+            elif i.tag not in _unrendered_tags:
+                hash.update(etree.tostring(i))
 
-def _crop_to_layer_bounds(tree: ElementTree, layer: 'Layer'):
-    tree = copy.deepcopy(tree)
-    node = _get_layer_node(tree, layer)
-    bounds = simpletransform.computeBBox(node, simpletransform.composeParents(node))
+        digest = hash.digest()
+        digests_by_layer[layer] = digest
 
-    _adjust_view_box(tree.getroot(), bounds)
+        return digest
 
-    return tree
+    walk(root_layer)
+
+    return digests_by_layer
+
+
+def _crop_to_bounds(overlay: _Overlay, tree: ElementTree, bounds):
+    _adjust_view_box(overlay, tree.getroot(), bounds)
 
 
 @contextmanager
@@ -145,51 +435,315 @@ def _safe_update_file(dest_path: Path):
     temp_path.rename(dest_path)
 
 
+# Writes the data to the file or to stdout, if the path is "-".
+def write_pdf_data(data: bytes, path: Path):
+    try:
+        if is_stdio_path(path):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            with _safe_update_file(path) as temp_path:
+                temp_path.write_bytes(data)
+    except OSError as e:
+        raise UserError('Could not write PDF file {}: {}'.format(path, e))
+
+
+# Returns the PDF data exported from the SVG data, without writing to any files, except to the cache.
+def _export_pdf_data(svg_data: bytes, cache: PDFCache, exporter: Exporter):
+    if cache is not None:
+        with measure('cache'):
+            cache_key = cache.get_key(svg_data, exporter.cache_key)
+            data = cache.fetch_data(cache_key)
+
+            if data is not None:
+                return data
+
+    with measure('export'):
+        data = exporter.export_pdf_data(svg_data)
+
+    if cache is not None:
+        with measure('cache'):
+            cache.store_data(cache_key, data)
+
+    return data
+
+
+def write_pdf(svg_data: bytes, path: Path, cache: PDFCache = None, exporter: Exporter = None):
+    if exporter is None:
+        exporter = OneShotExporter()
+
+    if is_stdio_path(path):
+        write_pdf_data(_export_pdf_data(svg_data, cache, exporter), path)
+
+        return
+
+    try:
+        with _safe_update_file(path) as temp_pdf_path:
+            if cache is not None:
+                with measure('cache'):
+                    cache_key = cache.get_key(svg_data, exporter.cache_key)
+
+                    if cache.fetch(cache_key, temp_pdf_path):
+                        return
+
+            with measure('export'):
+                if exporter.can_pipe:
+                    temp_pdf_path.write_bytes(exporter.export_pdf_data(svg_data))
+                else:
+                    with TemporaryDirectory() as temp_dir:
+                        temp_svg_path = Path(temp_dir) / 'document.svg'
+                        temp_svg_path.write_bytes(svg_data)
+                        exporter.export_pdf(temp_svg_path, temp_pdf_path)
+
+            if cache is not None:
+                with measure('cache'):
+                    cache.store(cache_key, temp_pdf_path)
+    except OSError as e:
+        raise UserError('Could not write PDF file {}: {}'.format(path, e))
+
+
+# Writes a PDF file with one page for each of the SVG documents. The pages are exported one after another by the same
+# exporter and then combined.
+def write_pdf_pages(svg_data_list: list, path: Path, cache: PDFCache = None, exporter: Exporter = None):
+    if len(svg_data_list) == 1:
+        write_pdf(svg_data_list[0], path, cache, exporter)
+
+        return
+
+    with TemporaryDirectory() as temp_dir:
+        page_paths = []
+
+        for i, svg_data in enumerate(svg_data_list):
+            page_path = Path(temp_dir) / 'page-{}.pdf'.format(i)
+            write_pdf(svg_data, page_path, cache, exporter)
+            page_paths.append(page_path)
+
+        with measure('merge pages'):
+            data = concatenate_files(page_paths)
+
+    write_pdf_data(data, path)
+
+
 class SVGDocument:
     def __init__(self, tree: ElementTree):
         self.tree = tree
-        self.layers = _gather_layers(tree)
 
-    def save_to_pdf(self, path: Path, layers: list = None, region: 'Layer' = None):
+        with measure('index ids'):
+            self.nodes_by_id = index_nodes_by_id(tree)
+
+        with measure('gather layers'):
+            self.layers = _gather_layers(tree)
+
+        # List of (layer, transformation) pairs applied to the tree while it is being filtered.
+        self.transformations = []
+
+        # Computed on first use by get_layer_bounds().
+        self._bounds_by_layer = None
+
+        # Filled on first use by get_output_digest(). Shared with transformed documents, as the digests of the layers
+        # do not depend on the transformations.
+        self._digests_by_layer = {}
+
+    # Returns the bounds of the content of a layer as (xmin, xmax, ymin, ymax), taking the transformations of this
+    # document into account. Returns None for layers without content.
+    def get_layer_bounds(self, layer: 'Layer'):
+        if self._bounds_by_layer is None:
+            overlay = _Overlay()
+
+            with measure('bounds'):
+                try:
+                    for i, transformation in self.transformations:
+                        _transform_layer(overlay, self.tree, self.nodes_by_id, i, transformation)
+
+                    self._bounds_by_layer = _compute_layer_bounds(self.tree, self.nodes_by_id, self.layers)
+                finally:
+                    overlay.revert()
+
+        return self._bounds_by_layer[layer]
+
+    # Returns a digest of everything which influences how the filtered document is rendered. Hidden layers, content of
+    # <defs> elements which is not referenced from the selected layers and editor state like the current zoom level do
+    # not contribute to the digest.
+    def get_output_digest(self, layers: list = None, region: 'Layer' = None):
         if layers is None:
             layers = [self.layers]
 
-        tree = _hide_deselected_layers(self.tree, layers)
+        with measure('digest'):
+            return self._get_output_digest(layers, region)
+
+    def _get_output_digest(self, layers: list, region: 'Layer'):
+        if not self._digests_by_layer:
+            self._digests_by_layer.update(_compute_layer_digests(self.tree, self.nodes_by_id, self.layers))
+
+        hash = hashlib.sha256()
+
+        for layer, transformation in self.transformations:
+            hash.update(repr((layer.path, transformation.m)).encode())
+
+        layer_nodes = []
+        ancestor_nodes = []
+
+        for layer in sorted(layers, key=lambda x: x.path):
+            node = _get_layer_node(self.tree, self.nodes_by_id, layer)
+            layer_nodes.append(node)
+
+            hash.update(repr(layer.path).encode())
+            hash.update(self._digests_by_layer[layer])
+
+            # The ancestors of selected layers only contribute their attributes, as their other content is hidden.
+            for i in _get_ancestor_nodes(node)[1:]:
+                _update_digest(hash, i)
+                ancestor_nodes.append(i)
 
         if region is not None:
-            tree = _crop_to_layer_bounds(tree, region)
+            hash.update(repr((region.path, self.get_layer_bounds(region))).encode())
 
-        with _safe_update_file(path) as temp_pdf_path:
-            with TemporaryDirectory() as temp_dir:
-                temp_svg_path = Path(temp_dir) / 'document.svg'
-                tree.write(str(temp_svg_path))
+        # Attributes of the ancestors may reference content too, e.g. a filter applied to a parent layer.
+        referenced_nodes = find_referenced_nodes(
+            itertools.chain((j for i in layer_nodes for j in i.iter(tag=etree.Element)), ancestor_nodes),
+            self.nodes_by_id)
 
-                args = [
-                    'inkscape',
-                    '--export-area-page',
-                    '--export-pdf',
-                    str(temp_pdf_path),
-                    str(temp_svg_path)]
+        for i in sorted(referenced_nodes, key=lambda x: x.get('id')):
+            hash.update(etree.tostring(i))
 
-                try:
-                    subprocess.run(args, check=True, stderr=subprocess.PIPE)
-                except CalledProcessError as error:
-                    sys.stderr.buffer.write(error.stderr)
+        # Stylesheets apply to the whole document.
+        for i in self.tree.iter(_style_tag):
+            hash.update(etree.tostring(i))
+
+        return hash.hexdigest()
+
+    # Moves the images embedded in the document to files in image_dir, so that their data is not serialized again for
+    # each output. The document is modified permanently. Returns the number of images which were moved.
+    def externalize_images(self, image_dir: Path):
+        with measure('externalize images'):
+            count = externalize_images(self.tree, image_dir)
+
+        # The digests include the references to the images instead of their data from now on.
+        self._digests_by_layer.clear()
+
+        return count
+
+    # Returns the bounds of the page, as defined by the view box of the document, as (xmin, xmax, ymin, ymax).
+    def get_page_bounds(self):
+        xmin, ymin, xsize, ysize = _get_view_box(self.tree.getroot())
+
+        return xmin, xmin + xsize, ymin, ymin + ysize
+
+    # Returns the matrix which maps the coordinates of the parent of a layer to the coordinates of the document. The
+    # transformations of this document are not taken into account.
+    def get_parent_matrix(self, layer: 'Layer'):
+        mat = [[1, 0, 0], [0, 1, 0]]
+
+        # Skip the layer itself and the root element.
+        for i in reversed(_get_ancestor_nodes(_get_layer_node(self.tree, self.nodes_by_id, layer))[1:-1]):
+            mat = simpletransform.composeTransform(mat, simpletransform.parseTransform(i.get('transform')))
+
+        return mat
+
+    # The tree is modified in place while the returned context is active and restored afterwards. The document is
+    # cropped to bounds, if specified, or otherwise to the bounds of region.
+    @contextmanager
+    def filtered_tree(
+            self, layers: list = None, region: 'Layer' = None, prune: bool = False, gc_defs: bool = False,
+            bounds: tuple = None):
+        if layers is None:
+            layers = [self.layers]
+
+        if bounds is None and region is not None:
+            # Needs to happen before the transformations are applied below, as they are also applied while computing
+            # the bounds.
+            bounds = self.get_layer_bounds(region)
+
+            if bounds is None:
+                raise UserError('Clip layer has no content: {}'.format('/'.join(region.path)))
+
+        overlay = _Overlay()
+
+        try:
+            with measure('filter'):
+                for layer, transformation in self.transformations:
+                    _transform_layer(overlay, self.tree, self.nodes_by_id, layer, transformation)
+
+                hidden_nodes = _hide_deselected_layers(overlay, self.tree, self.nodes_by_id, layers)
+
+                if bounds is not None:
+                    _crop_to_bounds(overlay, self.tree, bounds)
+
+                # The clip layer may be pruned, so this needs to happen after its bounds have been computed.
+                if prune or gc_defs:
+                    removed_defs_nodes = _remove_unreferenced_nodes(
+                        overlay, self.tree, self.nodes_by_id, hidden_nodes, prune, gc_defs)
 
-                    # TODO: Wrap in UserError
-                    raise UserError('Command failed: {}'.format(' '.join(args)))
+                    if gc_defs:
+                        _print_removed_defs_stats(removed_defs_nodes)
 
+            yield self.tree
+        finally:
+            with measure('filter'):
+                overlay.revert()
+
+    def filtered_svg_data(
+            self, layers: list = None, region: 'Layer' = None, prune: bool = False, gc_defs: bool = False,
+            bounds: tuple = None):
+        with self.filtered_tree(layers, region, prune, gc_defs, bounds) as tree:
+            with measure('serialize'):
+                return etree.tostring(tree)
+
+    def save_to_pdf(
+            self, path: Path, layers: list = None, region: 'Layer' = None, prune: bool = False,
+            gc_defs: bool = False, cache: PDFCache = None, exporter: Exporter = None):
+        write_pdf(self.filtered_svg_data(layers, region, prune, gc_defs), path, cache, exporter)
+
+    # Like save_to_pdf(), but without blocking the event loop. Takes layer patterns and the path of the clip layer
+    # instead of layers, see ExportJob. Returns an ExportResult and raises UserError if the export failed.
+    async def export(
+            self, path: Path, layers: list = None, clip: str = None, offsets: dict = None,
+            exporter: 'AsyncExporter' = None):
+        from inkscapeflatten.asyncexport import ExportJob, get_default_exporter
+
+        if exporter is None:
+            exporter = get_default_exporter()
+
+        result = await exporter.export(self, ExportJob(path, layers, clip, offsets))
+
+        if result.error is not None:
+            raise result.error
+
+        return result
+
+    # Runs multiple ExportJob instances concurrently and returns an ExportResult for each of them. Failed jobs do not
+    # stop the other jobs and are reported through their results.
+    async def export_many(self, jobs: list, exporter: 'AsyncExporter' = None):
+        from inkscapeflatten.asyncexport import get_default_exporter
+
+        if exporter is None:
+            exporter = get_default_exporter()
+
+        return await exporter.export_many(self, jobs)
+
+    # Returns a document sharing the tree and layers with this document, which applies the transformations when it is
+    # filtered.
     def with_transformed_layers(self, transformations_by_layer):
-        tree = copy.deepcopy(self.tree)
+        # Allows sharing the bounds computed for the untransformed document.
+        if not transformations_by_layer:
+            return self
 
-        for layer, transformation in transformations_by_layer.items():
-            _transform_layer(tree, layer, transformation)
+        document = copy.copy(self)
+        document.transformations = self.transformations + list(transformations_by_layer.items())
+        document._bounds_by_layer = None
 
-        return type(self)(tree)
+        return document
 
+    # Reads the document from stdin, if the path is "-".
     @classmethod
     def from_file(cls, path: Path):
-        return cls(etree.parse(str(path), XMLParser(huge_tree=True)))
+        try:
+            with measure('parse'):
+                tree = etree.parse(sys.stdin.buffer if is_stdio_path(path) else str(path), XMLParser(huge_tree=True))
+        except (OSError, etree.XMLSyntaxError) as e:
+            raise UserError('Could not read SVG file {}: {}'.format(path, e))
+
+        return cls(tree)
 
 
 class Layer(Mapping):
@@ -198,6 +752,10 @@ class Layer(Mapping):
         self.path = path
 
         self._items = [(i.name, i) for i in children]
+        self._children_by_name = {}
+
+        for name, child in self._items:
+            self._children_by_name.setdefault(name, []).append(child)
 
     def __len__(self):
         return len(self._items)
@@ -206,12 +764,24 @@ class Layer(Mapping):
         return iter(name for name, _ in self._items)
 
     def __getitem__(self, item):
-        for name, child in self._items:
-            if name == item:
-                return child
-        else:
+        children = self._children_by_name.get(item)
+
+        # Like the first match of a search, the first child with the name wins.
+        if children is None:
             raise KeyError(item)
 
+        return children[0]
+
+    def items(self):
+        return list(self._items)
+
+    def values(self):
+        return [child for _, child in self._items]
+
+    # Returns all children with the specified name. Inkscape does not prevent sibling layers from having the same name.
+    def get_all(self, name):
+        return self._children_by_name.get(name, [])
+
     def __hash__(self):
         # It's handy than we can create sets of layers using the instance's identities.
         return id(self)
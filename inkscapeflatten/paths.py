@@ -0,0 +1,135 @@
+import re
+
+from inkscapeflatten.vendored import cubicsuperpath, simplepath
+
+_command_pattern = re.compile(r'([MLHVCSQTAZmlhvcsqtaz])')
+_number_pattern = re.compile(r'[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?')
+_token_pattern = re.compile(r'[MLHVCSQTAZmlhvcsqtaz]|' + _number_pattern.pattern)
+_delimiters = ' \t\r\n,'
+_delete_delimiters = str.maketrans('', '', _delimiters)
+
+
+def _get_command_definitions():
+    definitions = {}
+
+    for command, (implicit_command, count, _, axes) in simplepath.pathdefs.items():
+        x_indices = [i for i, axis in enumerate(axes) if axis == 'x']
+        y_indices = [i for i, axis in enumerate(axes) if axis == 'y']
+
+        definitions[command] = command, count, implicit_command, [], []
+        definitions[command.lower()] = command, count, implicit_command.lower(), x_indices, y_indices
+
+    return definitions
+
+
+# Maps each command to its absolute command, number of parameters, the command used when the parameters are repeated
+# and the indices of the parameters which are relative to the x and y coordinates of the pen.
+_command_definitions = _get_command_definitions()
+
+
+# Parses SVG path data into the same list of absolute segments as simplepath.parsePath(). Instead of lexing the path
+# data one token at a time, the whole data is validated with a single regex substitution, then split at the commands
+# and all parameters of a command are converted at once.
+def parse_path(d: str):
+    # Everything besides commands and numbers must be delimiters.
+    if _token_pattern.sub('', d).translate(_delete_delimiters):
+        raise Exception('Invalid path data!')
+
+    parts = _command_pattern.split(d)
+
+    if parts[0].strip(_delimiters):
+        raise Exception('Invalid path, no initial command.')
+
+    segments = []
+    pen_x, pen_y = 0.0, 0.0
+    subpath_start = pen_x, pen_y
+    last_control = subpath_start
+    is_first = True
+
+    for i in range(1, len(parts), 2):
+        command = parts[i]
+        arguments = parts[i + 1]
+        # Numbers are usually separated by delimiters, but they don't have to be, e.g. in "1-2" or ".5.5".
+        tokens = arguments.replace(',', ' ').split()
+
+        try:
+            values = list(map(float, tokens))
+        except ValueError:
+            tokens = _number_pattern.findall(arguments)
+            values = list(map(float, tokens))
+
+        if is_first and command not in 'Mm':
+            raise Exception('Invalid path, must begin with moveto.')
+
+        is_first = False
+
+        if command in 'Aa':
+            # The flags of arcs are parsed as integers.
+            values = [int(token) if j % 7 in (3, 4) else value for j, (token, value) in enumerate(zip(tokens, values))]
+
+        position = 0
+
+        while True:
+            output_command, count, implicit_command, x_indices, y_indices = _command_definitions[command]
+
+            if position + count > len(values):
+                if i + 2 < len(parts):
+                    raise Exception('Invalid number of parameters')
+                else:
+                    raise Exception('Unexpected end of path')
+
+            params = values[position:position + count]
+            position += count
+
+            for j in x_indices:
+                params[j] += pen_x
+
+            for j in y_indices:
+                params[j] += pen_y
+
+            # Flesh out shortcut notation.
+            if output_command == 'H':
+                params.append(pen_y)
+                output_command = 'L'
+            elif output_command == 'V':
+                params.insert(0, pen_x)
+                output_command = 'L'
+            elif output_command == 'S':
+                params[0:0] = pen_x + (pen_x - last_control[0]), pen_y + (pen_y - last_control[1])
+                output_command = 'C'
+            elif output_command == 'T':
+                params[0:0] = pen_x + (pen_x - last_control[0]), pen_y + (pen_y - last_control[1])
+                output_command = 'Q'
+
+            if output_command == 'Z':
+                pen_x, pen_y = subpath_start
+            else:
+                pen_x, pen_y = params[-2:]
+
+                if output_command == 'M':
+                    subpath_start = pen_x, pen_y
+
+            if output_command == 'C' or output_command == 'Q':
+                last_control = params[-4], params[-3]
+            else:
+                last_control = pen_x, pen_y
+
+            segments.append([output_command, params])
+
+            if position == len(values):
+                break
+
+            # Additional parameters repeat the command, e.g. a moveto followed by more coordinates continues as a lineto.
+            command = implicit_command
+
+    return segments
+
+
+# Parses a list of numbers, e.g. the points of a <polyline> element.
+def parse_points(points: str):
+    return list(map(float, _number_pattern.findall(points)))
+
+
+# Same as cubicsuperpath.parsePath().
+def parse_cubic_super_path(d: str):
+    return cubicsuperpath.CubicSuperPath(parse_path(d))
@@ -0,0 +1,135 @@
+import fnmatch
+import functools
+import re
+
+from inkscapeflatten.util import UserError
+
+# A path component which matches any number of layers, including none.
+_recursive_wildcard = '**'
+
+
+def _compile_part(part: str):
+    if part == _recursive_wildcard:
+        return _recursive_wildcard
+    elif any(i in part for i in '*?['):
+        return re.compile(fnmatch.translate(part))
+    else:
+        # Plain names are looked up directly instead of being matched against every child.
+        return part
+
+
+def _matches(part, name: str):
+    if isinstance(part, str):
+        return part == name
+    else:
+        return name is not None and part.match(name) is not None
+
+
+# Matches a list of shell-like patterns against the full paths of the layers of a document. All patterns are matched in
+# a single traversal of the layer tree, which tracks the position reached in each pattern, like a non-deterministic
+# finite automaton.
+class LayerMatcher:
+    def __init__(self, patterns: list):
+        self.patterns = patterns
+
+        self._parts = [[_compile_part(j) for j in i.split('/')] for i in patterns]
+
+    # Adds the states reachable by letting ** match no layer.
+    def _close(self, states: set):
+        pending_states = list(states)
+
+        while pending_states:
+            pattern_index, part_index = pending_states.pop()
+            parts = self._parts[pattern_index]
+
+            if part_index < len(parts) and parts[part_index] is _recursive_wildcard:
+                state = pattern_index, part_index + 1
+
+                if state not in states:
+                    states.add(state)
+                    pending_states.append(state)
+
+        return states
+
+    def _iter_candidates(self, layer, states: set):
+        names = set()
+
+        for pattern_index, part_index in states:
+            parts = self._parts[pattern_index]
+
+            if part_index < len(parts):
+                part = parts[part_index]
+
+                if not isinstance(part, str) or part is _recursive_wildcard:
+                    return layer.values()
+
+                names.add(part)
+
+        return [j for i in names for j in layer.get_all(i)]
+
+    def _advance(self, states: set, name: str):
+        next_states = set()
+
+        for pattern_index, part_index in states:
+            parts = self._parts[pattern_index]
+
+            if part_index < len(parts):
+                part = parts[part_index]
+
+                if part is _recursive_wildcard:
+                    next_states.add((pattern_index, part_index))
+                elif _matches(part, name):
+                    next_states.add((pattern_index, part_index + 1))
+
+        return self._close(next_states)
+
+    # Returns a list of the matched layers for each pattern. The root layer itself is never matched.
+    def match(self, root_layer):
+        matched_layers = [[] for _ in self.patterns]
+
+        def walk(layer, states):
+            for child in self._iter_candidates(layer, states):
+                child_states = self._advance(states, child.name)
+
+                if not child_states:
+                    continue
+
+                for pattern_index, part_index in child_states:
+                    if part_index == len(self._parts[pattern_index]):
+                        matched_layers[pattern_index].append(child)
+
+                walk(child, child_states)
+
+        walk(root_layer, self._close({(i, 0) for i in range(len(self.patterns))}))
+
+        return matched_layers
+
+
+# The compiled patterns are reused when the same patterns are used for multiple outputs.
+@functools.lru_cache()
+def compile_patterns(patterns: tuple):
+    return LayerMatcher(list(patterns))
+
+
+# Returns a list of the layers below the root layer matched by each pattern.
+def select_layers(root_layer, patterns: list):
+    matched_layers = compile_patterns(tuple(patterns)).match(root_layer)
+
+    for pattern, layers in zip(patterns, matched_layers):
+        if not layers:
+            raise UserError('Pattern did not match any layers: {}'.format(pattern))
+
+    return matched_layers
+
+
+# Returns the layer with the full path below the root layer.
+def get_layer(root_layer, path: str):
+    layer = root_layer
+
+    for i in path.split('/'):
+        layer = layer.get(i)
+
+        if layer is None:
+            raise UserError('Layer not found: {}'.format(path))
+
+    return layer
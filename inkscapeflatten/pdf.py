@@ -0,0 +1,681 @@
+import re
+import zlib
+from pathlib import Path
+
+from inkscapeflatten.util import UserError
+
+_delimiters = b'()<>[]{}/%'
+
+_whitespace_pattern = re.compile(rb'(?:[ \t\r\n\f\0]|%[^\r\n]*)*')
+_eol_pattern = re.compile(rb'[ \t\r\n\f\0]*')
+_reference_pattern = re.compile(rb'(\d+)[ \t\r\n\f\0]+(\d+)[ \t\r\n\f\0]+R(?![^ \t\r\n\f\0()<>\[\]{}/%])')
+_number_pattern = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+_regular_pattern = re.compile(rb'[^ \t\r\n\f\0()<>\[\]{}/%]*')
+_object_header_pattern = re.compile(rb'(\d+)[ \t\r\n\f\0]+(\d+)[ \t\r\n\f\0]+obj')
+_xref_entry_pattern = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+class Name(str):
+    pass
+
+
+class Reference:
+    def __init__(self, number: int, generation: int = 0):
+        self.number = number
+        self.generation = generation
+
+    def __eq__(self, other):
+        return isinstance(other, Reference) and (self.number, self.generation) == (other.number, other.generation)
+
+    def __hash__(self):
+        return hash((self.number, self.generation))
+
+
+class Stream:
+    def __init__(self, dictionary: dict, data: bytes):
+        # The data is kept encoded with the filters listed in the dictionary.
+        self.dictionary = dictionary
+        self.data = data
+
+    def decode(self):
+        filters = self.dictionary.get('Filter', [])
+        parameters = self.dictionary.get('DecodeParms')
+
+        if not isinstance(filters, list):
+            filters = [filters]
+            parameters = [parameters]
+        elif not isinstance(parameters, list):
+            parameters = [parameters] * len(filters)
+
+        data = self.data
+
+        for name, i in zip(filters, parameters):
+            if name != 'FlateDecode':
+                raise UserError('Unsupported PDF stream filter: {}'.format(name))
+
+            data = _apply_predictor(zlib.decompress(data), i or {})
+
+        return data
+
+
+# Reverses the PNG predictors which may be used together with FlateDecode, e.g. in cross-reference streams.
+def _apply_predictor(data: bytes, parameters: dict):
+    predictor = parameters.get('Predictor', 1)
+
+    if predictor < 10:
+        if predictor != 1:
+            raise UserError('Unsupported PDF predictor: {}'.format(predictor))
+
+        return data
+
+    bits_per_pixel = parameters.get('Colors', 1) * parameters.get('BitsPerComponent', 8)
+    bytes_per_pixel = max(1, bits_per_pixel // 8)
+    row_size = (bits_per_pixel * parameters.get('Columns', 1) + 7) // 8
+    previous = bytearray(row_size)
+    output = bytearray()
+
+    for start in range(0, len(data), row_size + 1):
+        row_type = data[start]
+        row = bytearray(data[start + 1:start + 1 + row_size])
+
+        for i in range(len(row)):
+            left = row[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+            up = previous[i]
+            up_left = previous[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+
+            if row_type == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif row_type == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif row_type == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xff
+            elif row_type == 4:
+                p = left + up - up_left
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - up_left)
+                predicted = left if pa <= pb and pa <= pc else up if pb <= pc else up_left
+                row[i] = (row[i] + predicted) & 0xff
+
+        output.extend(row)
+        previous = row
+
+    return bytes(output)
+
+
+class _Parser:
+    def __init__(self, data: bytes, position: int = 0):
+        self.data = data
+        self.position = position
+
+    def error(self, message: str):
+        return UserError('Invalid PDF file at offset {}: {}'.format(self.position, message))
+
+    def skip_whitespace(self):
+        self.position = _whitespace_pattern.match(self.data, self.position).end()
+
+    def read_keyword(self):
+        self.skip_whitespace()
+        match = _regular_pattern.match(self.data, self.position)
+        self.position = match.end()
+
+        return match.group()
+
+    def parse_object(self):
+        self.skip_whitespace()
+        data = self.data
+        start = self.position
+        char = data[start:start + 1]
+
+        if char == b'/':
+            match = _regular_pattern.match(data, start + 1)
+            self.position = match.end()
+            name = re.sub(rb'#([0-9a-fA-F]{2})', lambda x: bytes([int(x.group(1), 16)]), match.group())
+
+            return Name(name.decode('latin-1'))
+        elif data.startswith(b'<<', start):
+            self.position += 2
+            dictionary = {}
+
+            while True:
+                self.skip_whitespace()
+
+                if data.startswith(b'>>', self.position):
+                    self.position += 2
+
+                    return dictionary
+
+                key = self.parse_object()
+
+                if not isinstance(key, Name):
+                    raise self.error('Expected a name as dictionary key.')
+
+                dictionary[key] = self.parse_object()
+        elif char == b'<':
+            end = data.find(b'>', start)
+
+            if end < 0:
+                raise self.error('Unterminated hex string.')
+
+            self.position = end + 1
+            digits = re.sub(rb'[^0-9a-fA-F]', b'', data[start + 1:end])
+
+            return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode())
+        elif char == b'(':
+            return self._parse_literal_string()
+        elif char == b'[':
+            self.position += 1
+            array = []
+
+            while True:
+                self.skip_whitespace()
+
+                if data.startswith(b']', self.position):
+                    self.position += 1
+
+                    return array
+
+                array.append(self.parse_object())
+        else:
+            match = _reference_pattern.match(data, start)
+
+            if match is not None:
+                self.position = match.end()
+
+                return Reference(int(match.group(1)), int(match.group(2)))
+
+            match = _number_pattern.match(data, start)
+
+            if match is not None:
+                self.position = match.end()
+                value = match.group()
+
+                return float(value) if b'.' in value else int(value)
+
+            keyword = self.read_keyword()
+
+            if keyword == b'true':
+                return True
+            elif keyword == b'false':
+                return False
+            elif keyword == b'null':
+                return None
+
+            raise self.error('Unexpected token: {!r}'.format(keyword or char))
+
+    def _parse_literal_string(self):
+        data = self.data
+        position = self.position + 1
+        depth = 0
+        output = bytearray()
+
+        while True:
+            if position >= len(data):
+                raise self.error('Unterminated string.')
+
+            char = data[position:position + 1]
+            position += 1
+
+            if char == b'\\':
+                escaped = data[position:position + 1]
+                position += 1
+
+                if escaped in _escapes:
+                    output.extend(_escapes[escaped])
+                elif escaped in b'01234567' and escaped:
+                    digits = re.match(rb'[0-7]{1,3}', data[position - 1:position + 2]).group()
+                    position += len(digits) - 1
+                    output.append(int(digits, 8) & 0xff)
+                elif escaped == b'\r':
+                    if data[position:position + 1] == b'\n':
+                        position += 1
+                elif escaped != b'\n':
+                    output.extend(escaped)
+            elif char == b'(':
+                depth += 1
+                output.extend(char)
+            elif char == b')':
+                if depth == 0:
+                    self.position = position
+
+                    return bytes(output)
+
+                depth -= 1
+                output.extend(char)
+            else:
+                output.extend(char)
+
+
+# Reads the objects of a PDF file through its cross-reference table or streams. Only the parts of PDF needed to
+# extract pages generated by Inkscape (i.e. cairo) are supported.
+class PDFReader:
+    def __init__(self, data: bytes):
+        self.data = data
+
+        # Maps object numbers to their offset or to (object stream number, index).
+        self._locations = {}
+        self._objects = {}
+        self.trailer = {}
+
+        start = data.rfind(b'startxref')
+
+        if start < 0:
+            raise UserError('Invalid PDF file: startxref not found.')
+
+        parser = _Parser(data, start + len(b'startxref'))
+        self._read_cross_references(parser.parse_object(), set())
+
+    @classmethod
+    def from_file(cls, path: Path):
+        try:
+            return cls(path.read_bytes())
+        except OSError as e:
+            raise UserError('Could not read PDF file {}: {}'.format(path, e))
+
+    def _read_cross_references(self, offset: int, visited_offsets: set):
+        # Sections read earlier are newer and take precedence.
+        if offset in visited_offsets:
+            return
+
+        visited_offsets.add(offset)
+        parser = _Parser(self.data, offset)
+        parser.skip_whitespace()
+
+        if self.data.startswith(b'xref', parser.position):
+            parser.position += len(b'xref')
+            trailer = self._read_cross_reference_table(parser)
+        else:
+            trailer = self._read_cross_reference_stream(parser)
+
+        for key, value in trailer.items():
+            self.trailer.setdefault(key, value)
+
+        if 'XRefStm' in trailer:
+            self._read_cross_references(trailer['XRefStm'], visited_offsets)
+
+        if 'Prev' in trailer:
+            self._read_cross_references(trailer['Prev'], visited_offsets)
+
+    def _read_cross_reference_table(self, parser: _Parser):
+        while True:
+            keyword_start = parser.position
+            keyword = parser.read_keyword()
+
+            if keyword == b'trailer':
+                return parser.parse_object()
+
+            parser.position = keyword_start
+            first = parser.parse_object()
+            count = parser.parse_object()
+
+            for i in range(count):
+                parser.skip_whitespace()
+                match = _xref_entry_pattern.match(self.data, parser.position)
+
+                if match is None:
+                    raise parser.error('Invalid cross-reference entry.')
+
+                parser.position = match.end()
+
+                if match.group(3) == b'n':
+                    self._locations.setdefault(first + i, int(match.group(1)))
+
+    def _read_cross_reference_stream(self, parser: _Parser):
+        stream = self._parse_indirect_object(parser.position)
+
+        if not isinstance(stream, Stream):
+            raise parser.error('Expected a cross-reference stream.')
+
+        dictionary = stream.dictionary
+        widths = dictionary['W']
+        index = dictionary.get('Index', [0, dictionary['Size']])
+        data = stream.decode()
+        position = 0
+
+        def read_field(width, default):
+            nonlocal position
+
+            if width == 0:
+                return default
+
+            value = int.from_bytes(data[position:position + width], 'big')
+            position += width
+
+            return value
+
+        for first, count in zip(index[0::2], index[1::2]):
+            for number in range(first, first + count):
+                type = read_field(widths[0], 1)
+                field_2 = read_field(widths[1], 0)
+                field_3 = read_field(widths[2], 0)
+
+                if type == 1:
+                    self._locations.setdefault(number, field_2)
+                elif type == 2:
+                    self._locations.setdefault(number, (field_2, field_3))
+
+        return dictionary
+
+    def _parse_indirect_object(self, offset: int):
+        parser = _Parser(self.data, offset)
+        parser.skip_whitespace()
+        match = _object_header_pattern.match(self.data, parser.position)
+
+        if match is None:
+            raise parser.error('Expected an object header.')
+
+        parser.position = match.end()
+        value = parser.parse_object()
+
+        if isinstance(value, dict):
+            keyword_start = parser.position
+
+            if parser.read_keyword() == b'stream':
+                return self._parse_stream_data(value, parser)
+
+            parser.position = keyword_start
+
+        return value
+
+    def _parse_stream_data(self, dictionary: dict, parser: _Parser):
+        data = self.data
+        start = parser.position
+
+        # The keyword is followed by either CRLF or LF.
+        if data.startswith(b'\r\n', start):
+            start += 2
+        elif data.startswith(b'\n', start) or data.startswith(b'\r', start):
+            start += 1
+
+        length = self.resolve(dictionary.get('Length'))
+
+        if not isinstance(length, int) \
+                or not data.startswith(b'endstream', _eol_pattern.match(data, start + length).end()):
+            # Fall back to searching for the end of the stream if the length is wrong.
+            end = data.find(b'endstream', start)
+
+            if end < 0:
+                raise parser.error('Unterminated stream.')
+
+            length = len(data[start:end].rstrip(b'\r\n'))
+
+        return Stream(dictionary, data[start:start + length])
+
+    def _get_object_from_stream(self, stream_number: int, index: int):
+        stream = self.get(stream_number)
+        data = stream.decode()
+        parser = _Parser(data)
+        offsets = []
+
+        for _ in range(stream.dictionary['N']):
+            offsets.append((parser.parse_object(), parser.parse_object()))
+
+        number, offset = offsets[index]
+
+        return _Parser(data, stream.dictionary['First'] + offset).parse_object()
+
+    def get(self, number: int):
+        if number not in self._objects:
+            location = self._locations.get(number)
+
+            if location is None:
+                value = None
+            elif isinstance(location, tuple):
+                value = self._get_object_from_stream(*location)
+            else:
+                value = self._parse_indirect_object(location)
+
+            self._objects[number] = value
+
+        return self._objects[number]
+
+    def resolve(self, value):
+        while isinstance(value, Reference):
+            value = self.get(value.number)
+
+        return value
+
+    # Returns the dictionary of each page, with the inheritable attributes of the page tree copied in.
+    def get_pages(self):
+        pages = []
+
+        def walk(node, inherited):
+            node = self.resolve(node)
+            inherited = dict(inherited)
+
+            for i in ['Resources', 'MediaBox', 'CropBox', 'Rotate']:
+                if i in node:
+                    inherited[i] = node[i]
+
+            if node.get('Type') == 'Pages':
+                for i in self.resolve(node['Kids']):
+                    walk(i, inherited)
+            else:
+                page = dict(node)
+                page.update(inherited)
+                pages.append(page)
+
+        walk(self.resolve(self.trailer['Root'])['Pages'], {})
+
+        return pages
+
+
+def _format_number(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, int):
+        return str(value)
+    else:
+        text = '{:.6f}'.format(value).rstrip('0').rstrip('.')
+
+        # Negative values which round to zero.
+        return '0' if text == '-0' else text
+
+
+def _format_name(name: str):
+    return '/' + ''.join(
+        i if 0x21 <= ord(i) <= 0x7e and i.encode() not in _delimiters and i != '#' else '#{:02x}'.format(ord(i))
+        for i in name)
+
+
+# Writes a new PDF file, into which objects from other PDF files can be copied.
+class PDFWriter:
+    def __init__(self):
+        # Objects by number. Numbers start at 1 and each entry is None until the object has been set.
+        self._objects = [None]
+
+        # References to the imported objects by object number, by reader. This also keeps the readers alive.
+        self._imported_references_by_reader = {}
+
+    def reserve(self):
+        self._objects.append(None)
+
+        return Reference(len(self._objects) - 1)
+
+    def set(self, reference: Reference, value):
+        self._objects[reference.number] = value
+
+    def add(self, value):
+        reference = self.reserve()
+        self.set(reference, value)
+
+        return reference
+
+    # Copies a value read from the reader, including all objects referenced from it, into this file.
+    def import_value(self, reader: PDFReader, value):
+        if isinstance(value, Reference):
+            imported_references = self._imported_references_by_reader.setdefault(reader, {})
+            reference = imported_references.get(value.number)
+
+            if reference is None:
+                reference = self.reserve()
+                imported_references[value.number] = reference
+                self.set(reference, self.import_value(reader, reader.get(value.number)))
+
+            return reference
+        elif isinstance(value, dict):
+            return {k: self.import_value(reader, v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self.import_value(reader, i) for i in value]
+        elif isinstance(value, Stream):
+            # The length is written together with the data.
+            dictionary = {k: v for k, v in value.dictionary.items() if k != 'Length'}
+
+            return Stream(self.import_value(reader, dictionary), value.data)
+        else:
+            return value
+
+    # Copies a page into this file as a form XObject. Returns the reference to the XObject and the page's media box.
+    def import_page(self, reader: PDFReader, page: dict):
+        media_box = [float(i) for i in reader.resolve(page['MediaBox'])]
+        contents = reader.resolve(page.get('Contents', []))
+
+        if isinstance(contents, Stream):
+            contents = [contents]
+
+        contents = [reader.resolve(i) for i in contents]
+
+        if len(contents) == 1:
+            # Keep the content stream encoded.
+            stream = contents[0]
+            dictionary = {k: v for k, v in stream.dictionary.items() if k in ['Filter', 'DecodeParms']}
+            data = stream.data
+        else:
+            dictionary = {Name('Filter'): Name('FlateDecode')}
+            data = zlib.compress(b'\n'.join(i.decode() for i in contents))
+
+        dictionary.update({
+            Name('Type'): Name('XObject'),
+            Name('Subtype'): Name('Form'),
+            Name('BBox'): media_box,
+            Name('Resources'): page.get('Resources', {})})
+
+        if 'Group' in page:
+            dictionary[Name('Group')] = page['Group']
+
+        return self.add(self.import_value(reader, Stream(dictionary, data))), media_box
+
+    def _serialize(self, value, output: list):
+        if value is None:
+            output.append('null')
+        elif isinstance(value, Name):
+            output.append(_format_name(value))
+        elif isinstance(value, (bool, int, float)):
+            output.append(_format_number(value))
+        elif isinstance(value, bytes):
+            output.append('<' + value.hex() + '>')
+        elif isinstance(value, str):
+            output.append('<' + value.encode('utf-16-be').hex() + '>')
+        elif isinstance(value, Reference):
+            output.append('{} {} R'.format(value.number, value.generation))
+        elif isinstance(value, list):
+            output.append('[')
+
+            for i in value:
+                self._serialize(i, output)
+
+            output.append(']')
+        elif isinstance(value, dict):
+            output.append('<<')
+
+            for k, v in value.items():
+                output.append(_format_name(k))
+                self._serialize(v, output)
+
+            output.append('>>')
+        else:
+            raise TypeError('Cannot serialize {!r}'.format(value))
+
+    def _serialize_object(self, value):
+        if isinstance(value, Stream):
+            dictionary = dict(value.dictionary)
+            dictionary[Name('Length')] = len(value.data)
+            output = []
+            self._serialize(dictionary, output)
+
+            return ' '.join(output).encode() + b'\nstream\n' + value.data + b'\nendstream'
+        else:
+            output = []
+            self._serialize(value, output)
+
+            return ' '.join(output).encode()
+
+    def to_bytes(self, root: Reference):
+        data = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+
+        for number, value in enumerate(self._objects[1:], 1):
+            offsets.append(len(data))
+            data.extend('{} 0 obj\n'.format(number).encode())
+            data.extend(self._serialize_object(value))
+            data.extend(b'\nendobj\n')
+
+        xref_offset = len(data)
+        data.extend('xref\n0 {}\n0000000000 65535 f \n'.format(len(self._objects)).encode())
+
+        for i in offsets:
+            data.extend('{:010d} 00000 n \n'.format(i).encode())
+
+        trailer = self._serialize_object({Name('Size'): len(self._objects), Name('Root'): root})
+        data.extend(b'trailer\n' + trailer + '\nstartxref\n{}\n%%EOF\n'.format(xref_offset).encode())
+
+        return bytes(data)
+
+
+# Forms placed on a page, given as (form reference, x offset, y offset) tuples.
+class Page:
+    def __init__(self, width: float, height: float):
+        self.width = width
+        self.height = height
+        self.placements = []
+
+    def place(self, form: Reference, x: float, y: float):
+        self.placements.append((form, x, y))
+
+
+# Writes a PDF file with one page for each of the pages.
+def write_pages(writer: PDFWriter, pages: list):
+    pages_reference = writer.reserve()
+    page_references = []
+
+    for page in pages:
+        xobjects = {}
+        operations = []
+
+        for form, x, y in page.placements:
+            name = 'F{}'.format(len(xobjects))
+            xobjects[Name(name)] = form
+            operations.append('q 1 0 0 1 {} {} cm /{} Do Q'.format(_format_number(x), _format_number(y), name))
+
+        contents = writer.add(
+            Stream({Name('Filter'): Name('FlateDecode')}, zlib.compress('\n'.join(operations).encode())))
+
+        page_references.append(writer.add({
+            Name('Type'): Name('Page'),
+            Name('Parent'): pages_reference,
+            Name('MediaBox'): [0, 0, page.width, page.height],
+            Name('Resources'): {Name('XObject'): xobjects},
+            Name('Contents'): contents}))
+
+    writer.set(pages_reference, {
+        Name('Type'): Name('Pages'),
+        Name('Kids'): page_references,
+        Name('Count'): len(page_references)})
+
+    return writer.add({Name('Type'): Name('Catalog'), Name('Pages'): pages_reference})
+
+
+# Returns a PDF file containing the pages of the PDF files, in order. Each page is copied onto a page of the same size.
+def concatenate_files(paths: list):
+    writer = PDFWriter()
+    pages = []
+
+    for path in paths:
+        reader = PDFReader.from_file(path)
+
+        for i in reader.get_pages():
+            form, (xmin, ymin, xmax, ymax) = writer.import_page(reader, i)
+            page = Page(xmax - xmin, ymax - ymin)
+            page.place(form, -xmin, -ymin)
+            pages.append(page)
+
+    return writer.to_bytes(write_pages(writer, pages))
@@ -0,0 +1,63 @@
+import re
+
+from lxml import etree
+from lxml.etree import Element, ElementTree
+
+_href_attributes = ['{http://www.w3.org/1999/xlink}href', 'href']
+_url_pattern = re.compile(r'url\(\s*["\']?#([^)"\'\s]+)')
+_style_tag = '{http://www.w3.org/2000/svg}style'
+
+
+def index_nodes_by_id(tree: ElementTree):
+    nodes_by_id = {}
+
+    for node in tree.iter(tag=etree.Element):
+        id = node.get('id')
+
+        # Like a search in document order, the first element with a given ID wins.
+        if id is not None:
+            nodes_by_id.setdefault(id, node)
+
+    return nodes_by_id
+
+
+# Yields the IDs referenced by a single element through its href attributes and url(#...) values in any attribute,
+# including the style attribute. For <style> elements, the stylesheet is also searched.
+def iter_referenced_ids(node: Element):
+    for name in _href_attributes:
+        value = node.get(name)
+
+        if value is not None and value.startswith('#'):
+            yield value[1:]
+
+    for value in node.attrib.values():
+        if 'url(' in value:
+            yield from _url_pattern.findall(value)
+
+    if node.tag == _style_tag and node.text:
+        yield from _url_pattern.findall(node.text)
+
+
+# Returns the set of elements referenced from any of the given elements. References are followed transitively and
+# everything within a referenced element's subtree counts as referencing too.
+def find_referenced_nodes(nodes, nodes_by_id: dict):
+    referenced_nodes = set()
+
+    def add_references(node):
+        for id in iter_referenced_ids(node):
+            target = nodes_by_id.get(id)
+
+            if target is not None and target not in referenced_nodes:
+                referenced_nodes.add(target)
+                pending_nodes.append(target)
+
+    pending_nodes = []
+
+    for i in nodes:
+        add_references(i)
+
+    while pending_nodes:
+        for i in pending_nodes.pop().iter(tag=etree.Element):
+            add_references(i)
+
+    return referenced_nodes
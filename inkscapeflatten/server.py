@@ -0,0 +1,101 @@
+import os
+import socket
+import socketserver
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+from inkscapeflatten.inkscape import SVGDocument
+from inkscapeflatten.util import UserError
+from inkscapeflatten_client import receive_message, send_message
+
+
+# Keeps the most recently used documents loaded, together with the bounds and digests computed for them. A document is
+# loaded again when the file's modification time or size changes. Embedded images of loaded documents are moved to
+# image_dir, unless it is None.
+class DocumentCache:
+    default_max_count = 8
+
+    def __init__(self, max_count: int = default_max_count, image_dir: Path = None):
+        self.max_count = max_count
+        self.image_dir = image_dir
+
+        self._documents_by_key = OrderedDict()
+
+    def get(self, path: Path):
+        try:
+            stat = path.stat()
+        except OSError as e:
+            raise UserError('Could not read SVG file {}: {}'.format(path, e))
+
+        key = str(path.resolve()), stat.st_mtime_ns, stat.st_size
+        document = self._documents_by_key.get(key)
+
+        if document is None:
+            document = SVGDocument.from_file(path)
+
+            if self.image_dir is not None:
+                document.externalize_images(self.image_dir)
+
+            self._documents_by_key[key] = document
+
+            while len(self._documents_by_key) > self.max_count:
+                self._documents_by_key.popitem(last=False)
+        else:
+            self._documents_by_key.move_to_end(key)
+
+        return document
+
+
+def _remove_stale_socket(socket_path: Path):
+    if not socket_path.exists():
+        return
+
+    # Only remove the socket if no server is listening on it anymore.
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()
+        else:
+            raise UserError('Another server is already listening on {}.'.format(socket_path))
+
+
+# Handles requests on a Unix socket until interrupted. Requests are handled one at a time, as documents are modified
+# while they are being filtered. handle_request is called with each request and returns the response.
+def serve(socket_path: Path, handle_request):
+    class RequestHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                request = receive_message(self.request)
+            except ValueError as e:
+                print('Invalid request: {}'.format(e), file=sys.stderr)
+
+                return
+
+            response = handle_request(request)
+
+            try:
+                send_message(self.request, response)
+            except OSError:
+                # The client went away.
+                pass
+
+    _remove_stale_socket(socket_path)
+
+    try:
+        server = socketserver.UnixStreamServer(str(socket_path), RequestHandler)
+    except OSError as e:
+        raise UserError('Could not listen on {}: {}'.format(socket_path, e))
+
+    try:
+        # Only the current user may send requests.
+        os.chmod(str(socket_path), 0o600)
+
+        print('Listening on {} ...'.format(socket_path), file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Collects the wall and CPU time spent in each stage of the pipeline. Stages may be measured concurrently from
+# multiple threads.
+class Timings:
+    def __init__(self):
+        # List of (stage, thread ID, thread name, start, wall time, CPU time) tuples, times in seconds.
+        self.records = []
+
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._start_cpu_time = time.process_time()
+        self._wall_time = None
+        self._cpu_time = None
+
+    def add(self, stage: str, start: float, wall_time: float, cpu_time: float):
+        thread = threading.current_thread()
+
+        with self._lock:
+            self.records.append((stage, thread.ident, thread.name, start - self._start_time, wall_time, cpu_time))
+
+    def finish(self):
+        self._wall_time = time.perf_counter() - self._start_time
+        self._cpu_time = time.process_time() - self._start_cpu_time
+
+    # Returns (stage, count, wall time, CPU time) for each stage, in the order in which the stages were first entered.
+    def get_summary(self):
+        summary_by_stage = {}
+
+        for stage, _, _, _, wall_time, cpu_time in sorted(self.records, key=lambda x: x[3]):
+            count, total_wall_time, total_cpu_time = summary_by_stage.get(stage, (0, 0, 0))
+            summary_by_stage[stage] = count + 1, total_wall_time + wall_time, total_cpu_time + cpu_time
+
+        return [(stage, *values) for stage, values in summary_by_stage.items()]
+
+    def format_summary(self):
+        lines = ['{:<16} {:>6} {:>10} {:>10}'.format('Stage', 'Count', 'Wall [s]', 'CPU [s]')]
+
+        for stage, count, wall_time, cpu_time in self.get_summary():
+            lines.append('{:<16} {:>6} {:>10.3f} {:>10.3f}'.format(stage, count, wall_time, cpu_time))
+
+        lines.append('{:<16} {:>6} {:>10.3f} {:>10.3f}'.format('total', '', self._wall_time, self._cpu_time))
+
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return dict(
+            wall_time=self._wall_time,
+            cpu_time=self._cpu_time,
+            stages=[
+                dict(stage=stage, count=count, wall_time=wall_time, cpu_time=cpu_time)
+                for stage, count, wall_time, cpu_time in self.get_summary()])
+
+    # Returns the measured stages in the Trace Event Format, which can be loaded into chrome://tracing or Perfetto. Each
+    # thread gets its own track, which shows how concurrent jobs overlap.
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        thread_names = {}
+        events = []
+
+        for stage, thread_id, thread_name, start, wall_time, cpu_time in self.records:
+            thread_names[thread_id] = thread_name
+
+            events.append(dict(
+                name=stage,
+                ph='X',
+                pid=pid,
+                tid=thread_id,
+                ts=start * 1e6,
+                dur=wall_time * 1e6,
+                args=dict(cpu_time=cpu_time)))
+
+        for thread_id, thread_name in thread_names.items():
+            events.append(dict(name='thread_name', ph='M', pid=pid, tid=thread_id, args=dict(name=thread_name)))
+
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+
+_current_timings = None
+
+
+# Measures the time spent in the body of the with statement as a stage of the pipeline, if timings are being recorded.
+# The CPU time only includes the current thread and not the time spent in subprocesses.
+@contextmanager
+def measure(stage: str):
+    timings = _current_timings
+
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    start_cpu_time = time.thread_time()
+
+    try:
+        yield
+    finally:
+        timings.add(stage, start, time.perf_counter() - start, time.thread_time() - start_cpu_time)
+
+
+# Records the stages measured with measure() while the with statement is active, from all threads.
+@contextmanager
+def recording_timings():
+    global _current_timings
+
+    timings = Timings()
+    _current_timings = timings
+
+    try:
+        yield timings
+    finally:
+        _current_timings = None
+        timings.finish()
@@ -1,2 +1,10 @@
+from pathlib import Path
+
+
 class UserError(Exception):
     pass
+
+
+# A path given as "-" on the command line stands for stdin or stdout.
+def is_stdio_path(path: Path):
+    return str(path) == '-'
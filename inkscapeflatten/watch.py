@@ -0,0 +1,31 @@
+import os
+import time
+
+
+def _get_file_state(path):
+    try:
+        stat = os.stat(str(path))
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Yields once at the start and then every time one of the files has changed. Changes are detected by polling the
+# modification time and size of the files. A change is only reported after the files have stopped changing for one
+# interval, so that files are not read while they are still being written.
+def watch_files(paths: list, interval: float = .2):
+    states = None
+
+    while True:
+        new_states = [_get_file_state(i) for i in paths]
+
+        if new_states == states:
+            time.sleep(interval)
+        else:
+            time.sleep(interval)
+
+            if [_get_file_state(i) for i in paths] == new_states:
+                states = new_states
+
+                yield
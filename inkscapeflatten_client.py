@@ -0,0 +1,64 @@
+# Thin client for "inkscape-flatten serve", which takes the same arguments as inkscape-flatten. The request is passed to
+# the server, which exports the outputs using documents it has already loaded. This module only uses the standard
+# library, as importing the inkscapeflatten package takes longer than most requests.
+
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+
+    if runtime_dir:
+        return Path(runtime_dir) / 'inkscape-flatten.sock'
+    else:
+        return Path(tempfile.gettempdir()) / 'inkscape-flatten-{}.sock'.format(os.getuid())
+
+
+def get_socket_path():
+    return Path(os.environ.get('INKSCAPE_FLATTEN_SOCKET') or default_socket_path())
+
+
+# Messages are JSON documents. The sender shuts down its side of the connection after sending a message.
+def send_message(connection: socket.socket, message: dict):
+    connection.sendall(json.dumps(message).encode())
+    connection.shutdown(socket.SHUT_WR)
+
+
+def receive_message(connection: socket.socket):
+    chunks = []
+
+    while True:
+        data = connection.recv(1 << 16)
+
+        if not data:
+            break
+
+        chunks.append(data)
+
+    return json.loads(b''.join(chunks))
+
+
+def main():
+    socket_path = get_socket_path()
+
+    try:
+        with socket.socket(socket.AF_UNIX) as connection:
+            connection.connect(str(socket_path))
+            send_message(connection, dict(argv=sys.argv[1:], cwd=os.getcwd()))
+            response = receive_message(connection)
+    except (OSError, ValueError) as e:
+        print('Error: Could not connect to inkscape-flatten server at {}: {}'.format(socket_path, e), file=sys.stderr)
+        sys.exit(1)
+
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    sys.exit(response['status'])
+
+
+if __name__ == '__main__':
+    main()
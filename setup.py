@@ -1,7 +1,13 @@
 import setuptools
 
 setuptools.setup(
+    packages=['inkscapeflatten', 'inkscapeflatten.vendored'],
+    py_modules=['inkscapeflatten_client'],
     entry_points=dict(
         console_scripts=[
-            'inkscape-flatten = inkscapeflatten:script_main']),
-    install_requires=['lxml'])
+            'inkscape-flatten = inkscapeflatten:script_main',
+            'inkscape-flatten-client = inkscapeflatten_client:main']),
+    install_requires=['lxml'],
+    extras_require=dict(
+        numpy=['numpy'],
+        cairosvg=['cairosvg']))
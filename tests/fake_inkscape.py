@@ -0,0 +1,86 @@
+# Stand-in for the inkscape executable which implements just enough of its command line and of its --shell mode to
+# test the exporters without Inkscape. The "PDF files" it writes contain the process ID of the fake and the SVG data it
+# read. Its behavior is controlled through environment variables:
+#
+#     FAKE_INKSCAPE_VERSION: Version reported by --version, defaults to 1.2.
+#     FAKE_INKSCAPE_SHELL: "exit" exits the shell before printing the first prompt, "crash" exits it when it opens a
+#         file containing "crash" and "no-output" makes it ignore export-do.
+
+import os
+import sys
+
+
+def write_pdf(svg_path: str, pdf_path: str):
+    if svg_path == '-':
+        svg_data = sys.stdin.buffer.read()
+    else:
+        with open(svg_path, 'rb') as file:
+            svg_data = file.read()
+
+    pdf_data = b'%PDF-1.4\n% fake inkscape ' + str(os.getpid()).encode() + b'\n' + svg_data
+
+    if pdf_path == '-':
+        sys.stdout.buffer.write(pdf_data)
+    else:
+        with open(pdf_path, 'wb') as file:
+            file.write(pdf_data)
+
+
+def write_prompt():
+    # Split the prompt, so that it is read in multiple parts.
+    sys.stdout.write('>')
+    sys.stdout.flush()
+    sys.stdout.write(' ')
+    sys.stdout.flush()
+
+
+def run_shell(behavior: str):
+    if behavior == 'exit':
+        sys.exit('fake inkscape: no shell')
+
+    sys.stdout.write('Inkscape interactive shell mode.\n')
+    write_prompt()
+
+    for line in sys.stdin:
+        line = line.strip()
+
+        if line == 'quit':
+            break
+
+        actions = {}
+
+        for i in line.split(';'):
+            name, _, value = i.strip().partition(':')
+            actions[name] = value
+
+        if behavior == 'crash':
+            with open(actions['file-open'], 'rb') as file:
+                if b'crash' in file.read():
+                    sys.exit('fake inkscape: crashed')
+
+        if 'export-do' in actions and behavior != 'no-output':
+            write_pdf(actions['file-open'], actions['export-filename'])
+
+        write_prompt()
+
+
+def main(args):
+    version = os.environ.get('FAKE_INKSCAPE_VERSION', '1.2')
+    options = dict(i.partition('=')[::2] for i in args if i.startswith('--'))
+
+    if '--version' in options:
+        print('Inkscape {} (fake)'.format(version))
+    elif '--shell' in options:
+        run_shell(os.environ.get('FAKE_INKSCAPE_SHELL', ''))
+    elif '--pipe' in options:
+        write_pdf('-', options['--export-filename'])
+    elif '--export-filename' in options:
+        write_pdf(args[-1], options['--export-filename'])
+    elif '--export-pdf' in options:
+        write_pdf(args[-1], args[args.index('--export-pdf') + 1])
+    else:
+        sys.exit('fake inkscape: unsupported arguments: {}'.format(args))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from lxml import etree
+
+from inkscapeflatten import asyncexport
+from inkscapeflatten.asyncexport import AsyncExporter, ExportJob
+from inkscapeflatten.exporter import Exporter
+from inkscapeflatten.inkscape import SVGDocument
+
+_svg_data = b'''<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" width="10" height="10">
+<g id="a" inkscape:groupmode="layer" inkscape:label="a"><rect width="1" height="1"/></g>
+<g id="b" inkscape:groupmode="layer" inkscape:label="b"><rect width="2" height="2"/></g>
+</svg>'''
+
+
+# "Renders" a PDF file by returning the SVG data.
+class _EchoExporter(Exporter):
+    cache_key = 'echo'
+
+    def export_pdf_data(self, svg_data: bytes):
+        return svg_data
+
+
+class AsyncExporterTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+
+        self.document = SVGDocument(etree.ElementTree(etree.fromstring(_svg_data)))
+
+    def test_export(self):
+        exporter = AsyncExporter(_EchoExporter())
+        job = ExportJob(self.temp_dir / 'a.pdf', ['a'])
+        result = asyncio.run(exporter.export(self.document, job))
+
+        self.assertTrue(result.ok)
+        self.assertEqual(job.path.read_bytes(), self.document.filtered_svg_data([self.document.layers['a']]))
+
+    # The filtering thread of a cancelled job keeps running. No other job may be filtered until it has reverted its
+    # changes to the document.
+    def test_cancel_while_filtering(self):
+        get_filtered_svg_data = asyncexport._get_filtered_svg_data
+        started = threading.Event()
+        release = threading.Event()
+        lock = threading.Lock()
+        running_counts = []
+        running_count = 0
+
+        def get_filtered_svg_data_slowly(*args):
+            nonlocal running_count
+
+            with lock:
+                running_count += 1
+                running_counts.append(running_count)
+
+            try:
+                started.set()
+                release.wait(10)
+
+                return get_filtered_svg_data(*args)
+            finally:
+                with lock:
+                    running_count -= 1
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            exporter = AsyncExporter(_EchoExporter())
+
+            first = asyncio.ensure_future(exporter.export(self.document, ExportJob(self.temp_dir / 'a.pdf', ['a'])))
+            await loop.run_in_executor(None, started.wait, 10)
+            first.cancel()
+
+            second = asyncio.ensure_future(exporter.export(self.document, ExportJob(self.temp_dir / 'b.pdf', ['b'])))
+
+            # Give the second job a chance to start filtering.
+            await asyncio.sleep(.1)
+            release.set()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+
+            return await second
+
+        original_data = etree.tostring(self.document.tree)
+
+        with mock.patch.object(asyncexport, '_get_filtered_svg_data', get_filtered_svg_data_slowly):
+            result = asyncio.run(run())
+
+        self.assertEqual(running_counts, [1, 1])
+        self.assertTrue(result.ok)
+        self.assertEqual(etree.tostring(self.document.tree), original_data)
+        self.assertFalse((self.temp_dir / 'a.pdf').exists())
+        self.assertEqual(
+            (self.temp_dir / 'b.pdf').read_bytes(), self.document.filtered_svg_data([self.document.layers['b']]))
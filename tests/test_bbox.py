@@ -0,0 +1,150 @@
+import random
+import unittest
+from unittest import mock
+
+from lxml import etree
+
+from inkscapeflatten import bbox
+from inkscapeflatten.util import UserError
+from inkscapeflatten.vendored import simpletransform
+
+_svg_namespace = 'http://www.w3.org/2000/svg'
+
+
+# Integers are kept as they are, e.g. the flags of arcs.
+def _format_numbers(*values):
+    return ' '.join(str(i) if isinstance(i, int) else '{:.3f}'.format(i) for i in values)
+
+
+# Builds random shapes and groups with random transformations. Only shapes supported by simpletransform.computeBBox()
+# are generated.
+class _RandomDocument:
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+
+    def coordinate(self):
+        return self.random.uniform(-100, 100)
+
+    def transform(self):
+        kind = self.random.choice(['none', 'translate', 'scale', 'rotate', 'matrix'])
+
+        if kind == 'none':
+            return None
+        elif kind == 'translate':
+            return 'translate({})'.format(_format_numbers(self.coordinate(), self.coordinate()))
+        elif kind == 'scale':
+            return 'scale({})'.format(_format_numbers(self.random.uniform(-3, 3), self.random.uniform(-3, 3)))
+        elif kind == 'rotate':
+            return 'rotate({})'.format(
+                _format_numbers(self.random.uniform(-180, 180), self.coordinate(), self.coordinate()))
+        else:
+            return 'matrix({})'.format(_format_numbers(*(self.random.uniform(-2, 2) for _ in range(6))))
+
+    def path_data(self):
+        parts = ['M', _format_numbers(self.coordinate(), self.coordinate())]
+
+        for _ in range(self.random.randint(1, 6)):
+            command = self.random.choice('LlCcQqAHVZ')
+
+            if command in 'LlHV':
+                parameters = [self.coordinate() for _ in range(1 if command in 'HV' else 2)]
+            elif command in 'Cc':
+                parameters = [self.coordinate() for _ in range(6)]
+            elif command in 'Qq':
+                parameters = [self.coordinate() for _ in range(4)]
+            elif command == 'A':
+                # ArcToPath() is wrong for arcs where ry is larger than rx.
+                rx = self.random.uniform(1, 100)
+                ry = self.random.uniform(1, rx)
+                parameters = [rx, ry, self.random.uniform(-180, 180), self.random.randint(0, 1),
+                              self.random.randint(0, 1), self.coordinate(), self.coordinate()]
+            else:
+                parameters = []
+
+            parts.extend([command, _format_numbers(*parameters)])
+
+        return ' '.join(parts)
+
+    def shape(self):
+        kind = self.random.choice(['path', 'rect', 'line', 'polygon', 'polyline', 'circle', 'ellipse'])
+        node = etree.Element('{{{}}}{}'.format(_svg_namespace, kind))
+
+        if kind == 'path':
+            node.set('d', self.path_data())
+        elif kind == 'rect':
+            node.set('x', _format_numbers(self.coordinate()))
+            node.set('y', _format_numbers(self.coordinate()))
+            node.set('width', _format_numbers(self.random.uniform(0, 100)))
+            node.set('height', _format_numbers(self.random.uniform(0, 100)))
+        elif kind == 'line':
+            for i in ['x1', 'y1', 'x2', 'y2']:
+                node.set(i, _format_numbers(self.coordinate()))
+        elif kind in ['polygon', 'polyline']:
+            node.set('points', _format_numbers(*(self.coordinate() for _ in range(2 * self.random.randint(1, 6)))))
+        elif kind == 'circle':
+            node.set('cx', _format_numbers(self.coordinate()))
+            node.set('cy', _format_numbers(self.coordinate()))
+            node.set('r', _format_numbers(self.random.uniform(1, 100)))
+        else:
+            rx = self.random.uniform(1, 100)
+
+            node.set('cx', _format_numbers(self.coordinate()))
+            node.set('cy', _format_numbers(self.coordinate()))
+            node.set('rx', _format_numbers(rx))
+            node.set('ry', _format_numbers(self.random.uniform(1, rx)))
+
+        return node
+
+    def nodes(self, depth: int = 0):
+        nodes = []
+
+        for _ in range(self.random.randint(1, 4)):
+            if depth < 2 and self.random.random() < .3:
+                node = etree.Element('{{{}}}g'.format(_svg_namespace))
+                node.extend(self.nodes(depth + 1))
+            else:
+                node = self.shape()
+
+            transform = self.transform()
+
+            if transform is not None:
+                node.set('transform', transform)
+
+            nodes.append(node)
+
+        return nodes
+
+
+# Compares the bounding boxes with the ones computed by simpletransform.computeBBox(). Circles and ellipses are
+# approximated by Bézier curves by computeBBox(), so the results are only compared within a tolerance.
+class BBoxTest(unittest.TestCase):
+    def assert_same_bboxes(self, seeds):
+        for seed in seeds:
+            with self.subTest(seed=seed):
+                nodes = _RandomDocument(seed).nodes()
+                expected = simpletransform.computeBBox(nodes)
+                actual = bbox.compute_bbox(nodes, nodes_by_id={})
+                tolerance = 1e-4 * max(expected[1] - expected[0], expected[3] - expected[2], 1)
+
+                for i, j in zip(actual, expected):
+                    self.assertAlmostEqual(i, j, delta=tolerance)
+
+    @unittest.skipIf(bbox.numpy is None, 'NumPy is not installed.')
+    def test_numpy(self):
+        self.assert_same_bboxes(range(200))
+
+    def test_python(self):
+        with mock.patch.object(bbox, 'numpy', None):
+            self.assert_same_bboxes(range(200))
+
+    def test_units(self):
+        node = etree.fromstring('<rect xmlns="{}" x="1in" y="3pt" width="2mm" height="4px"/>'.format(_svg_namespace))
+
+        for i, j in zip(bbox.compute_bbox([node]), [96, 96 + 2 * 96 / 25.4, 4, 8]):
+            self.assertAlmostEqual(i, j)
+
+    def test_invalid_length(self):
+        node = etree.fromstring('<circle xmlns="{}" id="circle1" r="50%"/>'.format(_svg_namespace))
+
+        with self.assertRaisesRegex(UserError, 'circle1'):
+            bbox.compute_bbox([node])
@@ -0,0 +1,105 @@
+import shlex
+import sys
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from inkscapeflatten.exporter import OneShotExporter, ShellExporter, ShellUnavailableError, open_exporter
+from inkscapeflatten.util import UserError
+
+_fake_inkscape_path = Path(__file__).parent / 'fake_inkscape.py'
+
+_svg_data = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"/>'
+
+
+# Tests the exporters against tests/fake_inkscape.py instead of Inkscape.
+class ExporterTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+
+        self.svg_path = self.temp_dir / 'document.svg'
+        self.svg_path.write_bytes(_svg_data)
+
+    # Returns the path of a script running the fake with the environment variables set. Each script has its own path,
+    # as the version of an executable is cached.
+    def create_inkscape(self, **env):
+        path = self.temp_dir / 'inkscape-{}'.format(len(list(self.temp_dir.glob('inkscape-*'))))
+        env_args = ' '.join('{}={}'.format(name, shlex.quote(value)) for name, value in env.items())
+
+        path.write_text('#!/bin/sh\nexec env {} {} {} "$@"\n'.format(
+            env_args, shlex.quote(sys.executable), shlex.quote(str(_fake_inkscape_path))))
+        path.chmod(0o755)
+
+        return str(path)
+
+    def export(self, exporter, name: str):
+        pdf_path = self.temp_dir / name
+        exporter.export_pdf(self.svg_path, pdf_path)
+
+        return pdf_path.read_bytes()
+
+    def test_shell_exports_with_one_process(self):
+        with ShellExporter(self.create_inkscape()) as exporter:
+            first_data = self.export(exporter, 'first.pdf')
+            second_data = self.export(exporter, 'second.pdf')
+
+        self.assertTrue(first_data.endswith(_svg_data))
+        self.assertEqual(first_data, second_data)
+
+    def test_shell_unavailable(self):
+        with self.assertRaises(ShellUnavailableError):
+            ShellExporter(self.create_inkscape(FAKE_INKSCAPE_SHELL='exit'))
+
+    def test_shell_exits_while_exporting(self):
+        self.svg_path.write_bytes(b'<svg><!-- crash --></svg>')
+
+        with ShellExporter(self.create_inkscape(FAKE_INKSCAPE_SHELL='crash')) as exporter:
+            with self.assertRaises(UserError):
+                self.export(exporter, 'document.pdf')
+
+    def test_shell_restarts_after_exiting(self):
+        with ShellExporter(self.create_inkscape(FAKE_INKSCAPE_SHELL='crash')) as exporter:
+            first_data = self.export(exporter, 'first.pdf')
+            self.svg_path.write_bytes(b'<svg><!-- crash --></svg>')
+
+            with self.assertRaises(UserError):
+                self.export(exporter, 'crash.pdf')
+
+            self.svg_path.write_bytes(_svg_data)
+            second_data = self.export(exporter, 'second.pdf')
+
+        # The second file was exported by a new shell.
+        self.assertTrue(second_data.endswith(_svg_data))
+        self.assertNotEqual(first_data, second_data)
+
+    def test_shell_reports_unwritable_output(self):
+        with ShellExporter(self.create_inkscape()) as exporter:
+            with self.assertRaises(UserError):
+                self.export(exporter, 'missing/document.pdf')
+
+    def test_shell_does_not_export(self):
+        with ShellExporter(self.create_inkscape(FAKE_INKSCAPE_SHELL='no-output')) as exporter:
+            with self.assertRaises(UserError):
+                self.export(exporter, 'document.pdf')
+
+    def test_open_exporter_uses_shell(self):
+        with open_exporter(self.create_inkscape()) as exporter:
+            self.assertIsInstance(exporter, ShellExporter)
+
+    def test_open_exporter_falls_back_without_shell(self):
+        with open_exporter(self.create_inkscape(FAKE_INKSCAPE_SHELL='exit')) as exporter:
+            self.assertNotIsInstance(exporter, ShellExporter)
+            self.assertTrue(self.export(exporter, 'document.pdf').endswith(_svg_data))
+
+    def test_open_exporter_falls_back_on_old_versions(self):
+        with open_exporter(self.create_inkscape(FAKE_INKSCAPE_VERSION='0.92.4')) as exporter:
+            self.assertNotIsInstance(exporter, ShellExporter)
+            self.assertTrue(self.export(exporter, 'document.pdf').endswith(_svg_data))
+
+    def test_one_shot_pipe(self):
+        exporter = OneShotExporter(self.create_inkscape())
+
+        self.assertTrue(exporter.can_pipe)
+        self.assertTrue(exporter.export_pdf_data(_svg_data).endswith(_svg_data))
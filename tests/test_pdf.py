@@ -0,0 +1,98 @@
+import unittest
+import zlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from inkscapeflatten.pdf import Name, PDFReader, PDFWriter, Stream, concatenate_files
+from inkscapeflatten.util import UserError
+
+
+# Returns the data of a PDF file with a page for each media box. The content of each page is a comment containing its
+# index.
+def _create_pdf_data(media_boxes: list):
+    writer = PDFWriter()
+    pages_reference = writer.reserve()
+    pages = {Name('Type'): Name('Pages'), Name('Kids'): [], Name('Count'): len(media_boxes)}
+
+    # The media box is inherited from the page tree, if all pages have the same one.
+    inherit_media_box = len(set(map(tuple, media_boxes))) == 1
+
+    if inherit_media_box:
+        pages[Name('MediaBox')] = media_boxes[0]
+
+    for i, media_box in enumerate(media_boxes):
+        contents = writer.add(Stream(
+            {Name('Filter'): Name('FlateDecode')}, zlib.compress('% page {}'.format(i).encode())))
+        page = {Name('Type'): Name('Page'), Name('Parent'): pages_reference, Name('Contents'): contents}
+
+        if not inherit_media_box:
+            page[Name('MediaBox')] = media_box
+
+        pages[Name('Kids')].append(writer.add(page))
+
+    writer.set(pages_reference, pages)
+
+    return writer.to_bytes(writer.add({Name('Type'): Name('Catalog'), Name('Pages'): pages_reference}))
+
+
+class PDFTest(unittest.TestCase):
+    def test_round_trip(self):
+        value = {
+            'Integer': -12,
+            'Real': 1.5,
+            'Booleans': [True, False],
+            'Null': None,
+            'Name': Name('A name with (delimiters) and #'),
+            'Bytes': b'\x00(\\)\xff',
+            'Text': 'Text with ümlauts',
+            'Nested': [[], {}, [1, [2]]]}
+
+        writer = PDFWriter()
+        stream_reference = writer.add(Stream({Name('Filter'): Name('FlateDecode')}, zlib.compress(b'stream data')))
+        value_reference = writer.add(dict(value, Stream=stream_reference))
+        reader = PDFReader(writer.to_bytes(value_reference))
+
+        self.assertEqual(reader.trailer['Root'], value_reference)
+
+        read_value = reader.resolve(reader.trailer['Root'])
+        stream = reader.resolve(read_value.pop('Stream'))
+
+        # Text strings are written as UTF-16 and read back as bytes.
+        self.assertEqual(read_value.pop('Text'), value.pop('Text').encode('utf-16-be'))
+        self.assertEqual(read_value, value)
+        self.assertIsInstance(read_value['Name'], Name)
+        self.assertEqual(stream.decode(), b'stream data')
+
+    def test_concatenate_files(self):
+        with TemporaryDirectory() as temp_dir:
+            first_path = Path(temp_dir) / 'first.pdf'
+            second_path = Path(temp_dir) / 'second.pdf'
+
+            first_path.write_bytes(_create_pdf_data([[0, 0, 100, 200]]))
+            second_path.write_bytes(_create_pdf_data([[10, 20, 40, 60], [0, 0, 50, 50]]))
+
+            reader = PDFReader(concatenate_files([first_path, second_path]))
+
+        pages = reader.get_pages()
+
+        self.assertEqual(
+            [reader.resolve(i['MediaBox']) for i in pages], [[0, 0, 100, 200], [0, 0, 30, 40], [0, 0, 50, 50]])
+
+        for i, (page, expected_contents) in enumerate(zip(pages, [b'% page 0', b'% page 0', b'% page 1'])):
+            with self.subTest(page=i):
+                xobjects = reader.resolve(reader.resolve(page['Resources'])['XObject'])
+                form = reader.resolve(xobjects['F0'])
+
+                self.assertEqual(form.dictionary['Subtype'], 'Form')
+                self.assertEqual(form.decode(), expected_contents)
+
+        # The second file's first page is moved to the origin.
+        self.assertIn(b'1 0 0 1 -10 -20 cm', reader.resolve(pages[1]['Contents']).decode())
+
+    def test_invalid_file(self):
+        with TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / 'invalid.pdf'
+            path.write_bytes(b'not a PDF file')
+
+            with self.assertRaises(UserError):
+                concatenate_files([path])